@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 from django import forms
 from django.db import models
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.conf import settings
 from django.forms.widgets import TextInput
 from django.template.defaultfilters import safe
@@ -16,9 +17,11 @@ from fhcore.apps.db.admin.mixins import (
     ConfigurableWidgetsMixinAdmin)#, FixtureAdminMixin)
 
 from .fields import CommaSeparatedEmailField
-from .models import Attachment, Log, Email, EmailTemplate, STATUS
+from .models import (ArchivedEmail, ArchivedLog, Attachment, Log, Email,
+                     EmailTemplate, HEAVY_FIELDS, STATUS)
 from .preview_utils import (add_style_inline,
                     POSTOFFICE_TAGS_STYLES, 
+                    render_template_preview,
                     render_to_temporary_file,
                     POSTOFFICE_TEMPLATE_LIBS_TO_LOAD)
 
@@ -60,6 +63,16 @@ class CommaSeparatedEmailWidget(TextInput):
 
 
 
+class EmailChangeList(ChangeList):
+    """
+    Doesn't load the bodies, context and headers of the listed emails, which
+    are only shown on their change page.
+    """
+
+    def get_queryset(self, request):
+        return super(EmailChangeList, self).get_queryset(request).defer(*HEAVY_FIELDS)
+
+
 class EmailAdmin(admin.ModelAdmin):
     list_display = ('id', 'to_display', 'subject', 'template',
                     'status', 'last_updated')
@@ -86,6 +99,9 @@ class EmailAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super(EmailAdmin, self).get_queryset(request).select_related('template')
 
+    def get_changelist(self, request, **kwargs):
+        return EmailChangeList
+
     def to_display(self, instance):
         return ', '.join(instance.to)
     to_display.short_description = ugettext('to')
@@ -105,7 +121,7 @@ class EmailAdmin(admin.ModelAdmin):
     
     def requeue(modeladmin, request, queryset):
         """An admin action to requeue emails."""
-        queryset.update(status=STATUS.queued)
+        queryset.update(status=STATUS.queued, number_of_retries=0)
     requeue.short_description = ugettext('Requeue selected emails')
 
 class LogAdmin(admin.ModelAdmin):
@@ -116,6 +132,44 @@ class LogAdmin(admin.ModelAdmin):
                 else instance.message)
     get_message_preview.short_description = ugettext('Message')
 
+class ArchivedLogInline(admin.TabularInline):
+    model = ArchivedLog
+    extra = 0
+    readonly_fields = ('date', 'status', 'exception_type', 'message')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedEmailAdmin(admin.ModelAdmin):
+    """
+    Read only admin of the emails moved out of the queue by ``archive_mail``.
+    """
+    list_display = ('id', 'to_display', 'subject', 'template',
+                    'status', 'last_updated', 'archived_at')
+    list_filter = ['status', 'template']
+    search_fields = ('to', 'subject')
+    date_hierarchy = 'archived_at'
+    inlines = [ArchivedLogInline]
+    # Stored bodies are shown through the message fields
+    exclude = ('attachments', 'message_body', 'html_message_body')
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields
+                if field.name not in self.exclude]
+
+    def get_changelist(self, request, **kwargs):
+        return EmailChangeList
+
+    def has_add_permission(self, request):
+        return False
+
+    def to_display(self, instance):
+        return ', '.join(instance.to)
+    to_display.short_description = ugettext('to')
+    to_display.admin_order_field = 'to'
+
+
 class SubjectField(TextInput):
     def __init__(self, *args, **kwargs):
         super(SubjectField, self).__init__(*args, **kwargs)
@@ -240,7 +294,7 @@ class EmailTemplateAdmin(#FixtureAdminMixin,
         content_preview = POSTOFFICE_TEMPLATE_LIBS_TO_LOAD+content_preview
         content_preview = render_to_temporary_file(content_preview, context)
         context.update({'content':content_preview})
-        html_content_preview = render_to_temporary_file(obj.html_content, context)
+        html_content_preview = render_template_preview(obj, 'html_content', context)
         help_text = '<div class="help">%s</div>' % (_('*I dati in questa preview sono fittizzi e del tutto casuali'))
         return strip_spaces_between_tags(mark_safe("{help_text}<div style='width:860px; height:500px;'><iframe style='margin-left:107px;' width='97%' height='480px' srcdoc='{mail_message}'>PREVIEW</iframe></div>\
                     ".format(**{'help_text':help_text,
@@ -291,3 +345,4 @@ admin.site.register(Email, EmailAdmin)
 admin.site.register(Log, LogAdmin)
 admin.site.register(EmailTemplate, EmailTemplateAdmin)
 admin.site.register(Attachment, AttachmentAdmin)
+admin.site.register(ArchivedEmail, ArchivedEmailAdmin)
@@ -0,0 +1,193 @@
+"""
+Asyncio sending engine, used by ``send_queued()`` when ``SENDING_ENGINE`` is
+set to ``'asyncio'``. This module requires Python 3.5+ and is only imported
+when the engine is enabled.
+
+Emails to SMTP backends are sent over a per alias pool of aiosmtplib
+connections, other backends are called from the event loop's executor.
+"""
+import asyncio
+import threading
+from queue import Queue
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import sanitize_address
+
+from .instrumentation import measure_email
+from .settings import get_async_concurrency, get_backend
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+
+# Marks the end of the results put in the queue by the event loop thread
+_DONE = object()
+
+
+class AsyncSMTPPool(object):
+    """
+    A pool of at most ``max_size`` aiosmtplib connections, configured from a
+    Django SMTP ``EmailBackend`` instance.
+    """
+
+    def __init__(self, backend, max_size):
+        self.backend = backend
+        self.max_size = max_size
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._idle = []
+
+    async def open(self):
+        backend = self.backend
+        client = aiosmtplib.SMTP(
+            hostname=backend.host, port=backend.port,
+            username=backend.username or None,
+            password=backend.password or None,
+            use_tls=bool(backend.use_ssl), start_tls=bool(backend.use_tls),
+            timeout=backend.timeout, client_cert=backend.ssl_certfile,
+            client_key=backend.ssl_keyfile,
+        )
+        await client.connect()
+        return client
+
+    async def discard(self, client):
+        try:
+            await client.quit()
+        except Exception:
+            client.close()
+
+    async def sendmail(self, from_email, recipients, message):
+        async with self._semaphore:
+            for attempt in range(2):
+                client = self._idle.pop() if self._idle else await self.open()
+                try:
+                    await client.sendmail(from_email, recipients, message)
+                except ConnectionError:
+                    # Reconnect once if the server dropped the connection
+                    client.close()
+                    if attempt:
+                        raise
+                except (aiosmtplib.SMTPResponseException,
+                        aiosmtplib.SMTPRecipientsRefused):
+                    # The envelope is reset after a rejected message, so the
+                    # connection can be reused
+                    if client.is_connected:
+                        self._idle.append(client)
+                    raise
+                except Exception:
+                    client.close()
+                    raise
+                else:
+                    self._idle.append(client)
+                    return
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for client in idle:
+            await self.discard(client)
+
+
+class ExecutorPool(object):
+    """
+    Sends prepared messages of non SMTP backends from the event loop's
+    executor, at most ``max_size`` at a time.
+    """
+
+    def __init__(self, max_size):
+        self._semaphore = asyncio.Semaphore(max_size)
+
+    async def send(self, email):
+        loop = asyncio.get_event_loop()
+        async with self._semaphore:
+            await loop.run_in_executor(None, email.email_message().send)
+
+    async def close(self):
+        pass
+
+
+def get_pool(alias):
+    backend = get_connection(get_backend(alias))
+    concurrency = get_async_concurrency(alias)
+    if isinstance(backend, SMTPEmailBackend):
+        if aiosmtplib is None:
+            raise ImproperlyConfigured(
+                'aiosmtplib is required to send emails with the asyncio engine')
+        return AsyncSMTPPool(backend, concurrency)
+    return ExecutorPool(concurrency)
+
+
+async def send_email(pool, email):
+    if isinstance(pool, ExecutorPool):
+        await pool.send(email)
+        return
+
+    # Mirrors django.core.mail.backends.smtp.EmailBackend._send()
+    message = email.email_message()
+    recipients = message.recipients()
+    if not recipients:
+        return
+    encoding = message.encoding or settings.DEFAULT_CHARSET
+    from_email = sanitize_address(message.from_email, encoding)
+    recipients = [sanitize_address(addr, encoding) for addr in recipients]
+    await pool.sendmail(from_email, recipients,
+                        message.message().as_bytes(linesep='\r\n'))
+
+
+async def _send_all(emails, results):
+    pools = {}
+    try:
+        for email in emails:
+            alias = email.backend_alias or 'default'
+            if alias not in pools:
+                pools[alias] = get_pool(alias)
+
+        async def send(email):
+            alias = email.backend_alias or 'default'
+            try:
+                with measure_email(email, 'send'):
+                    await send_email(pools[alias], email)
+                results.put((email, None))
+            except Exception as e:
+                results.put((email, e))
+
+        await asyncio.gather(*[send(email) for email in emails])
+    finally:
+        for pool in pools.values():
+            await pool.close()
+
+
+def _run(emails, results):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_send_all(emails, results))
+    except Exception as e:
+        results.put(e)
+    finally:
+        loop.close()
+        results.put(_DONE)
+
+
+def send_emails(emails):
+    """
+    Sends prepared emails concurrently from an event loop running in a
+    background thread. Yields ``(email, exception)`` tuples as deliveries
+    complete, ``exception`` being None for sent emails.
+    """
+    results = Queue()
+    thread = threading.Thread(target=_run, args=(emails, results))
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        result = results.get()
+        if result is _DONE:
+            break
+        if isinstance(result, Exception):
+            raise result
+        yield result
+    thread.join()
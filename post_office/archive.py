@@ -0,0 +1,64 @@
+from django.db import transaction
+
+from .models import ArchivedEmail, ArchivedLog, Attachment, Email, Log, STATUS
+from .utils import delete_emails
+
+
+def get_field_names(model):
+    return [field.attname for field in model._meta.concrete_fields
+            if field.name != 'archived_at']
+
+
+def get_archivable(before, statuses):
+    return Email.objects.filter(status__in=statuses, last_updated__lt=before)
+
+
+def archive_batch(email_ids, before, statuses=(STATUS.sent, STATUS.failed)):
+    """
+    Copies the emails of ``email_ids`` that can still be archived, with their
+    logs and attachment links, to the archive tables and deletes them from
+    the queue tables, in one transaction.
+    """
+    with transaction.atomic():
+        # Rows are locked so they can't be requeued while being archived,
+        # and filtered again in case they were requeued since they were
+        # listed. SQLite has no row locks but doesn't let a concurrent
+        # write commit in the middle of the transaction.
+        emails = list(get_archivable(before, statuses).select_for_update()
+                      .filter(id__in=email_ids)
+                      .values(*get_field_names(ArchivedEmail)))
+        email_ids = [email['id'] for email in emails]
+        if not email_ids:
+            return 0
+        ArchivedEmail.objects.bulk_create([ArchivedEmail(**email) for email in emails])
+
+        logs = Log.objects.filter(email_id__in=email_ids) \
+            .values(*get_field_names(ArchivedLog))
+        ArchivedLog.objects.bulk_create([ArchivedLog(**log) for log in logs])
+
+        links = Attachment.emails.through.objects.filter(email_id__in=email_ids) \
+            .values_list('email_id', 'attachment_id')
+        through = ArchivedEmail.attachments.through
+        through.objects.bulk_create([
+            through(archivedemail_id=email_id, attachment_id=attachment_id)
+            for email_id, attachment_id in links
+        ])
+
+        return delete_emails(email_ids)
+
+
+def archive_emails(before, statuses=(STATUS.sent, STATUS.failed), batch_size=500):
+    """
+    Moves emails with one of ``statuses`` last updated before ``before``
+    from ``Email`` to ``ArchivedEmail``, ``batch_size`` at a time, and
+    returns the number of emails archived.
+    """
+    queryset = get_archivable(before, statuses).order_by('id').values_list('id', flat=True)
+    count = 0
+    last_id = 0
+    while True:
+        email_ids = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not email_ids:
+            return count
+        count += archive_batch(email_ids, before, statuses)
+        last_id = email_ids[-1]
@@ -1,8 +1,12 @@
 from django.core.files.base import ContentFile
 from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
 
 from .settings import get_default_priority
 
+# Number of messages inserted per query by send_messages()
+CHUNK_SIZE = 500
+
 
 class EmailBackend(BaseEmailBackend):
 
@@ -16,41 +20,72 @@ class EmailBackend(BaseEmailBackend):
         """
         Queue one or more EmailMessage objects and returns the number of
         email messages sent.
+
+        Messages are validated and inserted ``CHUNK_SIZE`` at a time, in a
+        single transaction.
         """
-        from .mail import create
-        from .utils import create_attachments
+        from .mail import _bulk_create_emails, create
+        from .metrics import count_emails
+        from .notify import notify
+        from .utils import chunked, create_attachments, parse_emails
+        from .validators import validate_email_with_name
 
         if not email_messages:
-            return
-
-        for email_message in email_messages:
-            subject = email_message.subject
-            from_email = email_message.from_email
-            message = email_message.body
-            headers = email_message.extra_headers
-
-            # Check whether email has 'text/html' alternative
-            alternatives = getattr(email_message, 'alternatives', ())
-            for alternative in alternatives:
-                if alternative[1].startswith('text/html'):
-                    html_message = alternative[0]
-                    break
-            else:
-                html_message = ''
-
-            attachment_files = dict([(name, ContentFile(content))
-                                    for name, content, _ in email_message.attachments])
-
-            email = create(sender=from_email,
-                           recipients=email_message.to, cc=email_message.cc,
-                           bcc=email_message.bcc, subject=subject,
-                           message=message, html_message=html_message,
-                           headers=headers)
-
-            if attachment_files:
-                attachments = create_attachments(attachment_files)
-
-                email.attachments.add(*attachments)
-
-            if get_default_priority() == 'now':
+            return 0
+
+        send_now = get_default_priority() == 'now'
+        # Mass mailings are usually sent from a few addresses
+        valid_senders = set()
+        sent_emails = []
+
+        with transaction.atomic():
+            for chunk in chunked(email_messages, CHUNK_SIZE):
+                emails = []
+                email_attachments = []
+                for email_message in chunk:
+                    from_email = email_message.from_email
+                    if from_email not in valid_senders:
+                        validate_email_with_name(from_email)
+                        valid_senders.add(from_email)
+
+                    # Check whether email has 'text/html' alternative
+                    alternatives = getattr(email_message, 'alternatives', ())
+                    for alternative in alternatives:
+                        if alternative[1].startswith('text/html'):
+                            html_message = alternative[0]
+                            break
+                    else:
+                        html_message = ''
+
+                    emails.append(create(
+                        sender=from_email,
+                        recipients=parse_emails(email_message.to),
+                        cc=parse_emails(email_message.cc),
+                        bcc=parse_emails(email_message.bcc),
+                        subject=email_message.subject,
+                        message=email_message.body, html_message=html_message,
+                        headers=email_message.extra_headers, commit=False,
+                        validated=True))
+
+                    attachment_files = dict([(name, ContentFile(content))
+                                            for name, content, _ in email_message.attachments])
+                    email_attachments.append(
+                        create_attachments(attachment_files) if attachment_files else [])
+
+                if send_now:
+                    # Emails are dispatched once saved
+                    for email, attachments in zip(emails, email_attachments):
+                        email.save()
+                        email.attachments.add(*attachments)
+                else:
+                    _bulk_create_emails(emails, email_attachments=email_attachments)
+                    notify()
+                    count_emails('emails_enqueued', emails)
+                sent_emails.extend(emails)
+
+        # Sending outside of the transaction doesn't keep it open
+        if send_now:
+            for email in sent_emails:
                 email.dispatch()
+
+        return len(sent_emails)
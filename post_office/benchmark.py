@@ -0,0 +1,263 @@
+"""
+Throughput benchmarks of the enqueue and delivery pipeline, see the
+``benchmark_mail`` management command.
+
+The benchmarks create, send and delete emails in the current database,
+they should only be run against a test database.
+"""
+import asyncore
+import itertools
+import smtpd
+import threading
+import time
+from collections import namedtuple
+
+from django.core import mail as django_mail
+from django.core.files.base import ContentFile
+from django.test.utils import override_settings
+
+from . import mail
+from .connections import connections
+from .models import Attachment, Email, EmailTemplate, STATUS
+from .settings import get_config, get_threads_per_process
+
+
+BACKENDS = {
+    'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+    'smtp': 'django.core.mail.backends.smtp.EmailBackend',
+}
+
+TEMPLATES = {
+    'none': None,
+    'simple': {
+        'subject': 'Hello {{ name }}',
+        'content': 'Hi {{ name }}, your order #{{ order_id }} has shipped.',
+        'html_content': '<p>Hi {{ name }}, your order #{{ order_id }} has shipped.</p>',
+    },
+    'complex': {
+        'subject': 'Your order #{{ order_id }} of {{ items|length }} items',
+        'content': (
+            'Hi {{ name|title }},\n'
+            '{% for item in items %}'
+            '{{ forloop.counter }}. {{ item.name|upper }} x{{ item.quantity }}: '
+            '{{ item.price|floatformat:2 }}\n'
+            '{% endfor %}'
+            'Total: {{ total|floatformat:2 }}'
+        ),
+        'html_content': (
+            '<p>Hi {{ name|title }},</p><table>'
+            '{% for item in items %}'
+            '<tr class="{% cycle \'odd\' \'even\' %}">'
+            '<td>{{ item.name|upper }}</td><td>{{ item.quantity }}</td>'
+            '<td>{% if item.price > 50 %}<b>{{ item.price|floatformat:2 }}</b>'
+            '{% else %}{{ item.price|floatformat:2 }}{% endif %}</td></tr>'
+            '{% endfor %}'
+            '</table><p>Total: {{ total|floatformat:2 }}</p>'
+        ),
+    },
+}
+
+Scenario = namedtuple('Scenario', 'count recipients attachment_size template '
+                                  'processes threads backend')
+
+
+class Stage(namedtuple('Stage', 'name emails seconds failed')):
+
+    @property
+    def rate(self):
+        """
+        Emails per second, or None when the stage took no measurable time.
+        """
+        if not self.seconds:
+            return None
+        return self.emails / self.seconds
+
+
+class SMTPStub(smtpd.SMTPServer):
+    """
+    A local SMTP server accepting and counting every message, run in a
+    thread with ``start()`` and ``stop()``.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.host = host
+        self.port = self.socket.getsockname()[1]
+        self.received = 0
+        self._running = False
+        self._thread = None
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.received += 1
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.1, count=1)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        asyncore.close_all()
+
+
+def get_scenarios(counts, recipients, attachment_sizes, templates, processes,
+                  threads, backends):
+    """
+    Returns a ``Scenario`` for each combination of the given values.
+    """
+    return [Scenario(*values) for values in itertools.product(
+        counts, recipients, attachment_sizes, templates, processes, threads,
+        backends)]
+
+
+def get_context(index):
+    items = [{'name': 'item %d' % i, 'quantity': i % 3 + 1, 'price': i * 7.5}
+             for i in range(20)]
+    return {
+        'name': 'user %d' % index,
+        'order_id': index,
+        'items': items,
+        'total': sum(item['price'] * item['quantity'] for item in items),
+    }
+
+
+def get_email_kwargs(scenario, index, template=None):
+    kwargs = {
+        'recipients': ['user%d-%d@example.com' % (index, i)
+                       for i in range(scenario.recipients)],
+        'sender': 'benchmark@example.com',
+    }
+    if template is None:
+        kwargs.update(subject='Order #%d' % index,
+                      message='Your order has shipped.',
+                      html_message='<p>Your order has shipped.</p>')
+    else:
+        kwargs.update(template=template, context=get_context(index))
+    return kwargs
+
+
+def get_attachments(scenario, index):
+    if not scenario.attachment_size:
+        return None
+    # Each email has its own content, identical files would be deduplicated
+    content = ('%d-' % index).encode('ascii') * scenario.attachment_size
+    return {'report.bin': ContentFile(content[:scenario.attachment_size])}
+
+
+def get_template(name):
+    if TEMPLATES[name] is None:
+        return None
+    template, created = EmailTemplate.objects.update_or_create(
+        name='benchmark-%s' % name, language='', defaults=TEMPLATES[name])
+    return template
+
+
+def clean_up(last_id):
+    """
+    Deletes the emails created after the email ``last_id`` and the
+    attachments they used, including their files.
+    """
+    emails = Email.objects.filter(id__gt=last_id)
+    attachments = list(Attachment.objects.filter(emails__in=emails).distinct())
+    emails.delete()
+    for attachment in attachments:
+        if not attachment.emails.exists():
+            attachment.file.delete(save=False)
+            attachment.delete()
+
+
+def run_stage(name, function):
+    start = time.time()
+    emails, failed = function()
+    return Stage(name, emails, time.time() - start, failed)
+
+
+def run_scenario(scenario, smtp_stub=None):
+    """
+    Measures ``send_many()``, ``send()``, ``get_queued()`` and
+    ``send_queued()`` for ``scenario`` and returns a list of ``Stage``.
+
+    Emails are sent with the ``BACKENDS`` entry named ``scenario.backend``,
+    ``smtp_stub`` is required by the ``smtp`` backend.
+    """
+    config = dict(get_config(),
+                  BACKENDS={'default': BACKENDS[scenario.backend]},
+                  THREADS_PER_PROCESS=scenario.threads or get_threads_per_process())
+    overrides = {'POST_OFFICE': config}
+    if scenario.backend == 'smtp':
+        overrides.update(EMAIL_HOST=smtp_stub.host, EMAIL_PORT=smtp_stub.port,
+                         EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                         EMAIL_USE_TLS=False, EMAIL_USE_SSL=False)
+
+    last_email = Email.objects.order_by('-id').first()
+    last_id = last_email.id if last_email else 0
+
+    with override_settings(**overrides):
+        template = get_template(scenario.template)
+        # Connections opened with another configuration can't be reused
+        connections.close()
+        try:
+            return _run_stages(scenario, template, last_id)
+        finally:
+            connections.close()
+            clean_up(last_id)
+            if hasattr(django_mail, 'outbox'):
+                django_mail.outbox = []
+
+
+def _run_stages(scenario, template, last_id):
+    stages = []
+    indexes = range(scenario.count)
+
+    def send_many():
+        mail.send_many([get_email_kwargs(scenario, i, template) for i in indexes])
+        return scenario.count, 0
+    stages.append(run_stage('send_many', send_many))
+    # Emails queued by send_many() are not delivered, so that the delivery
+    # stages measure emails with attachments
+    Email.objects.filter(id__gt=last_id).delete()
+    last_id = Email.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def send():
+        for i in indexes:
+            mail.send(attachments=get_attachments(scenario, i),
+                      **get_email_kwargs(scenario, i, template))
+        return scenario.count, 0
+    stages.append(run_stage('send', send))
+
+    def get_queued():
+        count = 0
+        while True:
+            emails = mail.get_queued()
+            if not emails:
+                return count, 0
+            count += len(emails)
+    stages.append(run_stage('get_queued', get_queued))
+    # Release the claims taken by get_queued()
+    Email.objects.filter(id__gt=last_id).update(status=STATUS.queued,
+                                                claimed_by='', claimed_at=None)
+
+    def send_queued():
+        pool = None
+        if scenario.processes > 1:
+            pool = mail.create_process_pool(scenario.processes)
+        total_sent, total_failed = 0, 0
+        try:
+            while True:
+                sent, failed = mail.send_queued(scenario.processes, pool=pool)
+                if not sent and not failed:
+                    return total_sent, total_failed
+                total_sent += sent
+                total_failed += failed
+        finally:
+            if pool is not None:
+                pool.terminate()
+    stages.append(run_stage('send_queued', send_queued))
+
+    return stages
@@ -0,0 +1,139 @@
+"""
+Storage of message bodies in ``EmailBody``, enabled with ``BODY_STORE``.
+
+Bodies of at least ``BODY_STORE_MIN_SIZE`` characters are compressed and
+stored once for all the emails that have them, the ``message`` and
+``html_message`` columns of these emails being left empty. See
+``fields.StoredBodyField``.
+"""
+import hashlib
+import zlib
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+
+from .settings import get_body_compression, get_body_store, get_body_store_min_size
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Number of hashes looked up per query
+CHUNK_SIZE = 500
+
+# Bodies stored or reused in the last MIN_AGE minutes are never deleted as
+# unused, as emails referencing them may be being created
+MIN_AGE = 60
+
+
+def compress(text, method):
+    data = text.encode('utf-8')
+    if method == 'zlib':
+        return zlib.compress(data, 6)
+    if method == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('zstandard is required to compress bodies with zstd')
+        return zstandard.ZstdCompressor().compress(data)
+    raise ImproperlyConfigured('Unknown body compression %r, use "zlib" or "zstd"' % method)
+
+
+def decompress(data, method):
+    data = bytes(data)
+    if method == 'zlib':
+        data = zlib.decompress(data)
+    elif method == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('zstandard is required to read bodies compressed with zstd')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raise ValueError('Unknown body compression %r' % method)
+    return data.decode('utf-8')
+
+
+def get_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def should_store(text):
+    return bool(text) and get_body_store() and len(text) >= get_body_store_min_size()
+
+
+def get_bodies(hashes):
+    from .models import EmailBody
+    hashes = list(hashes)
+    bodies = {}
+    for i in range(0, len(hashes), CHUNK_SIZE):
+        for body in EmailBody.objects.filter(hash__in=hashes[i:i + CHUNK_SIZE]):
+            bodies[body.hash] = body
+    return bodies
+
+
+def store_bodies(texts):
+    """
+    Returns a dict of the ``EmailBody`` of each of ``texts``, storing those
+    that aren't stored yet.
+    """
+    from .models import EmailBody
+    texts_by_hash = dict((get_hash(text), text) for text in set(texts))
+    bodies = get_bodies(texts_by_hash)
+    touch_bodies(body.id for body in bodies.values())
+
+    method = get_body_compression()
+    missing = [EmailBody(hash=body_hash, compression=method,
+                         data=compress(text, method))
+               for body_hash, text in texts_by_hash.items() if body_hash not in bodies]
+    if missing:
+        try:
+            with transaction.atomic():
+                EmailBody.objects.bulk_create(missing)
+        except IntegrityError:
+            # Some of them were stored by another process in the meantime
+            with transaction.atomic():
+                for body in missing:
+                    EmailBody.objects.get_or_create(hash=body.hash, defaults={
+                        'compression': body.compression, 'data': body.data})
+        # Primary keys are not set by bulk_create() on all databases
+        bodies.update(get_bodies(body.hash for body in missing))
+
+    for body_hash, body in bodies.items():
+        body.cache_text(texts_by_hash[body_hash])
+    return dict((texts_by_hash[body_hash], body) for body_hash, body in bodies.items())
+
+
+def touch_bodies(body_ids):
+    """
+    Protects reused bodies from being deleted as unused before the emails
+    referencing them are saved. Bodies are only updated once per half
+    ``MIN_AGE``, so that emails sharing a body don't all write to it.
+    """
+    from .models import EmailBody
+    body_ids = list(body_ids)
+    current_time = now()
+    stale_date = current_time - timedelta(minutes=MIN_AGE / 2.0)
+    for i in range(0, len(body_ids), CHUNK_SIZE):
+        EmailBody.objects.filter(id__in=body_ids[i:i + CHUNK_SIZE],
+                                 last_used__lt=stale_date) \
+            .update(last_used=current_time)
+
+
+def store_email_bodies(emails):
+    """
+    Moves the large bodies of unsaved ``emails`` to ``EmailBody``, with one
+    lookup for all of them.
+    """
+    fields = [field for field in emails[0]._meta.concrete_fields
+              if getattr(field, 'body_field', None)] if emails else []
+    texts = [email.__dict__.get(field.attname) for email in emails for field in fields]
+    texts = [text for text in texts if should_store(text)]
+    if not texts:
+        return
+    bodies = store_bodies(texts)
+    for email in emails:
+        for field in fields:
+            text = email.__dict__.get(field.attname)
+            if text in bodies:
+                field.set_body(email, bodies[text])
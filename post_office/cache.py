@@ -1,6 +1,13 @@
+import mmap
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+from django.template import Template
 from django.template.defaultfilters import slugify
 
-from .settings import get_cache_backend
+from .settings import (get_attachment_cache_size, get_attachment_cache_temp_files,
+                       get_cache_backend, get_template_cache_size)
 
 # Stripped down version of caching functions from django-dbtemplates
 # https://github.com/jezdez/django-dbtemplates/blob/develop/dbtemplates/utils/cache.py
@@ -24,3 +31,110 @@ def get(name):
 
 def delete(name):
     return cache_backend.delete(get_cache_key(name))
+
+
+class CompiledTemplateCache(object):
+    """
+    An in-process LRU of compiled ``Template`` objects for the subject,
+    content and html_content of ``EmailTemplate`` instances, so that the
+    same template isn't parsed again for every email rendered from it.
+
+    Entries are keyed by (template id, last_updated, field name), so an
+    outdated ``EmailTemplate`` instance never gets a newer compiled template.
+    """
+
+    def __init__(self):
+        self._templates = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, email_template, field):
+        source = getattr(email_template, field)
+        if email_template.pk is None:
+            return Template(source)
+
+        key = (email_template.pk, email_template.last_updated, field)
+        with self._lock:
+            template = self._templates.pop(key, None)
+            if template is not None:
+                self._templates[key] = template
+                return template
+
+        template = Template(source)
+
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > get_template_cache_size():
+                self._templates.popitem(last=False)
+        return template
+
+    def invalidate(self, template_id):
+        with self._lock:
+            for key in [key for key in self._templates if key[0] == template_id]:
+                del self._templates[key]
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+compiled_templates = CompiledTemplateCache()
+
+
+def get_compiled_template(email_template, field):
+    """
+    Returns the compiled template for ``field`` of ``email_template``.
+    """
+    return compiled_templates.get(email_template, field)
+
+
+class AttachmentCache(object):
+    """
+    Caches attachment payloads while a batch of emails is prepared, so that
+    a file attached to several emails is read from storage only once.
+
+    Payloads are keyed by their stored file name, which deduplicated
+    attachments share. Up to ``ATTACHMENT_CACHE_SIZE`` bytes are kept in
+    memory; if ``ATTACHMENT_CACHE_TEMP_FILES`` is set, payloads that don't fit
+    are kept in memory mapped temporary files instead of being read again.
+    """
+
+    def __init__(self, max_size=None, use_temp_files=None):
+        if max_size is None:
+            max_size = get_attachment_cache_size()
+        if use_temp_files is None:
+            use_temp_files = get_attachment_cache_temp_files()
+        self.max_size = max_size
+        self.use_temp_files = use_temp_files
+        self.size = 0
+        self._payloads = {}
+        self._mapped = {}
+
+    def get(self, attachment):
+        key = attachment.file.name
+        if key in self._payloads:
+            return self._payloads[key]
+        if key in self._mapped:
+            return self._mapped[key][1][:]
+
+        attachment.file.open('rb')
+        payload = attachment.file.read()
+        attachment.file.close()
+
+        if self.size + len(payload) <= self.max_size:
+            self._payloads[key] = payload
+            self.size += len(payload)
+        elif self.use_temp_files:
+            temp_file = tempfile.TemporaryFile()
+            temp_file.write(payload)
+            temp_file.flush()
+            self._mapped[key] = (temp_file, mmap.mmap(temp_file.fileno(), 0,
+                                                      access=mmap.ACCESS_READ))
+        return payload
+
+    def close(self):
+        for temp_file, mapped in self._mapped.values():
+            mapped.close()
+            temp_file.close()
+        self._mapped = {}
+        self._payloads = {}
+        self.size = 0
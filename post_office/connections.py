@@ -1,8 +1,138 @@
-from threading import local
+import os
+import socket
+import time
+from smtplib import SMTPException, SMTPServerDisconnected
+from threading import BoundedSemaphore, Lock, local
 
 from django.core.mail import get_connection
 
-from .settings import get_backend
+from .settings import (get_backend, get_connection_idle_timeout,
+                       get_connection_max_messages, get_connection_pool_size)
+
+
+# Pooled connections idle for longer than this many seconds are checked
+# with a NOOP before being reused
+LIVENESS_CHECK_AFTER = 5
+
+
+def is_alive(connection):
+    """
+    Returns False if an SMTP connection has been dropped by the server.
+    Backends without an SMTP connection are assumed to be alive.
+    """
+    smtp = getattr(connection, 'connection', None)
+    if smtp is None or not hasattr(smtp, 'noop'):
+        return True
+    try:
+        return smtp.noop()[0] == 250
+    except (SMTPServerDisconnected, socket.error):
+        return False
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of open connections to a single email backend.
+
+    The pool can be used in place of a backend instance as an
+    ``EmailMessage`` connection: each call to ``send_messages()`` checks a
+    connection out, reconnecting once if the server disconnected, and
+    returns it to the pool. Connections idle for longer than
+    ``CONNECTION_IDLE_TIMEOUT`` seconds or that sent
+    ``CONNECTION_MAX_MESSAGES`` messages are closed.
+    """
+
+    def __init__(self, backend, max_size=None):
+        if max_size is None:
+            max_size = get_connection_pool_size()
+        self.backend = backend
+        self.max_size = max_size
+        self.pid = os.getpid()
+        self._semaphore = BoundedSemaphore(max_size)
+        self._lock = Lock()
+        self._idle = []  # (connection, last_used) tuples
+        self._sent = {}  # Messages sent by each open connection
+
+    def open(self):
+        connection = get_connection(self.backend)
+        connection.open()
+        self._sent[id(connection)] = 0
+        return connection
+
+    def discard(self, connection):
+        self._sent.pop(id(connection), None)
+        close_quietly(connection)
+
+    def acquire(self):
+        self._semaphore.acquire()
+        try:
+            idle_timeout = get_connection_idle_timeout()
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, last_used = self._idle.pop()
+
+                idle_time = time.time() - last_used
+                if idle_timeout is not None and idle_time > idle_timeout:
+                    self.discard(connection)
+                elif idle_time > LIVENESS_CHECK_AFTER and not is_alive(connection):
+                    self.discard(connection)
+                else:
+                    return connection
+            return self.open()
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def release(self, connection, sent=0, discard=False):
+        try:
+            self._sent[id(connection)] = self._sent.get(id(connection), 0) + sent
+            max_messages = get_connection_max_messages()
+            if discard or (max_messages and self._sent[id(connection)] >= max_messages):
+                self.discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append((connection, time.time()))
+        finally:
+            self._semaphore.release()
+
+    def send_messages(self, email_messages):
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                sent = connection.send_messages(email_messages)
+            except SMTPServerDisconnected:
+                self.release(connection, discard=True)
+                if attempt:
+                    raise
+            except SMTPException:
+                # On Python 3, smtplib exceptions are also socket errors,
+                # but a rejected message leaves the connection usable
+                self.release(connection)
+                raise
+            except socket.error:
+                self.release(connection, discard=True)
+                if attempt:
+                    raise
+            except Exception:
+                self.release(connection)
+                raise
+            else:
+                self.release(connection, sent=len(email_messages))
+                return sent
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, last_used in idle:
+            self.discard(connection)
 
 
 # Copied from Django 1.8's django.core.cache.CacheHandler
@@ -14,6 +144,8 @@ class ConnectionHandler(object):
     """
     def __init__(self):
         self._connections = local()
+        self._pools = {}
+        self._pools_lock = Lock()
 
     def __getitem__(self, alias):
         try:
@@ -33,12 +165,51 @@ class ConnectionHandler(object):
         self._connections.connections[alias] = connection
         return connection
 
+    def set_pool_group(self, name):
+        """
+        Gives the calling thread the connection pools of group ``name``,
+        separate from those of threads in other groups, e.g. so that a
+        priority lane can't take all the connections of another.
+        """
+        self._connections.pool_group = name
+
+    def get_pool(self, alias):
+        """
+        Returns the ``ConnectionPool`` of an alias, shared by all threads of
+        the calling thread's pool group.
+        """
+        key = (getattr(self._connections, 'pool_group', None), alias)
+        pool = self._pools.get(key)
+        # Connections inherited from a parent process must not be used
+        if pool is not None and pool.pid == os.getpid():
+            return pool
+
+        try:
+            backend = get_backend(alias)
+        except KeyError:
+            raise KeyError('%s is not a valid backend alias' % alias)
+
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                pool = self._pools[key] = ConnectionPool(backend)
+        return pool
+
     def all(self):
         return getattr(self._connections, 'connections', {}).values()
 
     def close(self):
         for connection in self.all():
             connection.close()
+        # Closed connections are discarded so that the next lookup opens
+        # a new one instead of returning a closed backend
+        self._connections.connections = {}
+
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
 
 
 connections = ConnectionHandler()
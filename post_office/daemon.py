@@ -0,0 +1,191 @@
+import signal
+import sys
+import threading
+import time
+
+from django.db import connection
+
+from .connections import connections
+from .logutils import setup_loghandlers
+from .mail import create_process_pool, send_queued
+from .notify import Listener, is_supported as notify_is_supported
+from .settings import (get_batch_size, get_max_polling_interval,
+                       get_min_polling_interval)
+from .utils import parse_priority
+
+
+logger = setup_loghandlers()
+
+
+class Daemon(object):
+    """
+    Keeps sending queued emails until it receives SIGTERM or SIGINT.
+
+    The process, its database connection and backend connections are reused
+    across batches. With several processes, a pool of sending processes is
+    started once and kept for the daemon's lifetime. The queue is polled
+    with an adaptive interval: the next batch is fetched right away after a
+    full batch, after ``MIN_POLLING_INTERVAL`` seconds after a partial one and
+    the interval doubles up to ``MAX_POLLING_INTERVAL`` while the queue is
+    empty. On PostgreSQL the daemon also wakes up as soon as an email is
+    queued, see ``post_office.notify``.
+    """
+
+    def __init__(self, processes=1, log_level=None, priorities=None,
+                 stop_event=None, close_connections=True, profile_dir=None):
+        self.processes = processes
+        self.log_level = log_level
+        self.priorities = priorities
+        self.profile_dir = profile_dir
+        # Backend connections are shared by the daemons of priority lanes,
+        # which then leave closing them to run_lanes()
+        self.close_connections = close_connections
+        self.pool = None
+        self._stop_event = stop_event or threading.Event()
+        self.listener = Listener() if notify_is_supported() else None
+
+    def stop(self, signum=None, frame=None):
+        logger.info('Received signal %s, stopping after the current batch.' % signum)
+        self._stop_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def wait(self, timeout):
+        """
+        Sleeps for ``timeout`` seconds, returning early when stopped or
+        when notified of a newly queued email.
+        """
+        if self.listener is None:
+            self._stop_event.wait(timeout)
+            return
+
+        deadline = time.time() + timeout
+        while not self.stopped:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            # Wait in short slices so that signals are handled promptly
+            if self.listener.wait(min(remaining, 1)):
+                return
+
+    def send_batch(self):
+        try:
+            total_sent, total_failed = send_queued(
+                self.processes, self.log_level, close_connections=False,
+                pool=self.pool, priorities=self.priorities,
+                profile_dir=self.profile_dir)
+        except Exception as e:
+            logger.error(e, exc_info=sys.exc_info(),
+                         extra={'status_code': 500})
+            raise
+
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+        return total_sent + total_failed
+
+    def run(self):
+        self.install_signal_handlers()
+        self.run_loop()
+
+    def run_loop(self):
+        min_interval = get_min_polling_interval()
+        max_interval = get_max_polling_interval()
+        interval = min_interval
+
+        logger.info('Started sending queued emails in daemon mode.')
+        if self.processes > 1 and self.pool is None:
+            # Started after installing the signal handlers, which the
+            # processes inherit so that they aren't interrupted mid-batch
+            self.pool = create_process_pool(self.processes)
+        try:
+            while not self.stopped:
+                processed = self.send_batch()
+
+                if processed >= get_batch_size():
+                    interval = min_interval
+                    continue
+
+                if processed:
+                    interval = min_interval
+                elif self.close_connections:
+                    # Don't keep idle connections open, the server would
+                    # eventually drop them anyway
+                    connections.close()
+
+                self.wait(interval)
+
+                if not processed:
+                    interval = min(interval * 2, max_interval)
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+            if self.close_connections:
+                connections.close()
+            if self.listener is not None:
+                self.listener.close()
+        logger.info('Daemon stopped.')
+
+
+def run_lanes(lanes, log_level=None, profile_dir=None, stop_event=None):
+    """
+    Runs a daemon per priority lane, each in its own thread with its own
+    number of processes and backend connection pools, so that a large batch
+    in one lane doesn't delay emails of the others. ``lanes`` is a list of
+    dictionaries with the ``priorities`` of the lane and its number of
+    ``processes``, see ``PRIORITY_LANES``.
+
+    Lanes stop when ``stop_event`` is set, on SIGTERM or SIGINT, or when
+    one of them fails, whose exception is then raised.
+    """
+    stop_event = stop_event or threading.Event()
+    daemons = [
+        Daemon(lane.get('processes', 1), log_level,
+               priorities=[parse_priority(priority) for priority in lane['priorities']],
+               stop_event=stop_event, close_connections=False,
+               profile_dir=profile_dir)
+        for lane in lanes
+    ]
+    # Signals are only delivered to the main thread
+    daemons[0].install_signal_handlers()
+
+    # Processes are forked before the lane threads start, as forking while
+    # other threads hold locks can leave the children deadlocked
+    for daemon in daemons:
+        if daemon.processes > 1:
+            daemon.pool = create_process_pool(daemon.processes)
+
+    errors = []
+
+    def run_loop(lane, daemon):
+        connections.set_pool_group(lane)
+        try:
+            daemon.run_loop()
+        except Exception as e:
+            # Stop the other lanes rather than silently running without one
+            errors.append(e)
+            stop_event.set()
+
+    threads = [threading.Thread(target=run_loop, args=(lane, daemon))
+               for lane, daemon in enumerate(daemons)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            # Join with a timeout so that signals are handled while waiting
+            while thread.is_alive():
+                thread.join(1)
+    finally:
+        stop_event.set()
+        connections.close()
+
+    if errors:
+        raise errors[0]
@@ -2,6 +2,7 @@ from django.db.models import TextField
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 
+from .bodies import should_store, store_bodies
 from .validators import validate_comma_separated_emails
 
 
@@ -56,3 +57,69 @@ class CommaSeparatedEmailField(TextField):
         field_class = 'django.db.models.fields.TextField'
         args, kwargs = introspector(self)
         return (field_class, args, kwargs)
+
+
+class StoredBody(object):
+    """
+    Descriptor of a ``StoredBodyField``, returning the text of the email's
+    ``EmailBody`` when the column is empty.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        attname = self.field.attname
+        if attname not in instance.__dict__:
+            # The column was deferred
+            instance.refresh_from_db(fields=[attname])
+        value = instance.__dict__[attname]
+        if not value:
+            body = getattr(instance, self.field.body_field)
+            if body is not None:
+                return body.text
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class StoredBodyField(TextField):
+    """
+    A text field whose value is moved to an ``EmailBody``, referenced by the
+    ``body_field`` foreign key, when the body store is enabled and the value
+    is large enough. Reading the attribute transparently returns the stored
+    text, querysets and ``values()`` see an empty column.
+
+    ``body_field`` must be declared after the field, so that it is saved
+    after it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.body_field = kwargs.pop('body_field')
+        super(StoredBodyField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(StoredBodyField, self).deconstruct()
+        kwargs['body_field'] = self.body_field
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(StoredBodyField, self).contribute_to_class(cls, name, *args, **kwargs)
+        setattr(cls, self.attname, StoredBody(self))
+
+    def set_body(self, instance, body):
+        setattr(instance, self.body_field, body)
+        instance.__dict__[self.attname] = ''
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if should_store(value):
+            self.set_body(model_instance, store_bodies([value])[value])
+            return ''
+        if value:
+            # The text was replaced, the stored body no longer applies
+            setattr(model_instance, self.body_field, None)
+        return value
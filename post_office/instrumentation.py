@@ -0,0 +1,77 @@
+"""
+Timings of the stages of sending queued emails, to find out where the time
+of a slow batch went.
+
+The stages of each email are timed in its ``timings`` dictionary:
+
+ - ``render``: rendering its template
+ - ``attachments``: reading its attachments
+ - ``send``: handing it to the backend, e.g. the SMTP transaction
+
+The stages of each batch sent by a process are timed in the ``timings``
+dictionary passed to ``batch_sent`` receivers:
+
+ - ``fetch``: loading the claimed emails
+ - ``load``: loading the bodies, context and headers of the emails sent
+ - ``prepare``: building the messages, rendering and attachments included
+ - ``send``: sending the messages from the threads or the event loop
+ - ``update``: writing statuses and logs
+
+Durations are also recorded in the ``<stage>_seconds`` histograms of email
+stages and the ``batch_<stage>_seconds`` histograms of batch stages, see
+``post_office.metrics``.
+"""
+import cProfile
+import os
+import time
+from contextlib import contextmanager
+
+from .metrics import get_metrics
+
+
+@contextmanager
+def measure(timings, stage, metric, labels=None):
+    """
+    Adds the duration of the block to ``timings[stage]`` and records it in
+    the ``metric`` histogram.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        timings[stage] = timings.get(stage, 0) + elapsed
+        get_metrics().observe(metric, elapsed, labels)
+
+
+def measure_email(email, stage):
+    return measure(email.timings, stage, '%s_seconds' % stage,
+                   {'backend': email.backend_alias or 'default'})
+
+
+def measure_batch(timings, stage):
+    return measure(timings, stage, 'batch_%s_seconds' % stage)
+
+
+@contextmanager
+def profiled(directory):
+    """
+    Profiles the block with cProfile and writes the statistics to a new file
+    in ``directory``. Does nothing if ``directory`` is None.
+
+    Yields a function that discards the profile, e.g. when there was nothing
+    to send. Only the current thread is profiled.
+    """
+    discarded = []
+    if directory is None:
+        yield lambda: None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield lambda: discarded.append(True)
+    finally:
+        profiler.disable()
+        if not discarded:
+            filename = 'post_office-%d-%d.prof' % (os.getpid(), time.time() * 1000000)
+            profiler.dump_stats(os.path.join(directory, filename))
@@ -1,32 +1,57 @@
+import math
+import os
+import socket
+from collections import defaultdict
+from datetime import timedelta
 from multiprocessing import Pool
 from multiprocessing.dummy import Pool as ThreadPool
+from uuid import uuid4
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import connection as db_connection
-from django.db.models import Q
+from django.db import (close_old_connections, connection as db_connection,
+                       connections as db_connections, transaction)
+from django.db.models import Count, F, Q
 from django.template import Context, Template
 from django.utils.timezone import now
 
+from .bodies import store_email_bodies
+from .cache import AttachmentCache, get_compiled_template
 from .connections import connections
-from .models import Email, EmailTemplate, Log, PRIORITY, STATUS
-from .settings import (get_available_backends, get_batch_size,
-                       get_log_level, get_sending_order, get_threads_per_process)
-from .utils import (get_email_template, parse_emails, parse_priority,
-                    split_emails, create_attachments)
+from .instrumentation import measure_batch, profiled
+from .metrics import count_emails, get_metrics, observe_delivery
+from .models import (Attachment, Email, EmailBody, EmailTemplate, HEAVY_FIELDS,
+                     Log, PRIORITY, STATUS)
+from .ratelimit import RateLimiter
+from .settings import (get_available_backends, get_backend_rate_limits,
+                       get_batch_size, get_claim_lease, get_domain_rate_limits,
+                       get_log_level, get_max_retries, get_sending_engine,
+                       get_sending_order, get_status_update_interval,
+                       get_threads_per_process)
+from .utils import (chunked, get_email_template, get_retry_delay,
+                    is_transient_error, parse_emails, parse_priority,
+                    create_attachments)
 from .logutils import setup_loghandlers
+from .validators import validate_email_with_name
+from .notify import notify
+from .signals import batch_sent
 
 
 logger = setup_loghandlers("INFO")
 
+# Maximum number of ids in a single "id IN (...)" query
+ID_CHUNK_SIZE = 500
+
 
 def create(sender, recipients=None, cc=None, bcc=None, subject='', message='',
            html_message='', context=None, scheduled_time=None, headers=None,
            template=None, priority=None, render_on_delivery=False, commit=True,
-           backend=''):
+           backend='', validated=False):
     """
     Creates an email from supplied keyword arguments. If template is
     specified, email subject and content will be rendered during delivery.
+    Pass ``validated=True`` if sender and recipients have already been
+    validated, so they aren't validated again when the email is saved.
     """
     priority = parse_priority(priority)
     status = None if priority == PRIORITY.now else STATUS.queued
@@ -55,15 +80,15 @@ def create(sender, recipients=None, cc=None, bcc=None, subject='', message='',
 
     else:
 
-        if template:
-            subject = template.subject
-            message = template.content
-            html_message = template.html_content
-
         _context = Context(context or {})
-        subject = Template(subject).render(_context)
-        message = Template(message).render(_context)
-        html_message = Template(html_message).render(_context)
+        if template:
+            subject = get_compiled_template(template, 'subject').render(_context)
+            message = get_compiled_template(template, 'content').render(_context)
+            html_message = get_compiled_template(template, 'html_content').render(_context)
+        else:
+            subject = Template(subject).render(_context)
+            message = Template(message).render(_context)
+            html_message = Template(html_message).render(_context)
 
         email = Email(
             from_email=sender,
@@ -79,9 +104,15 @@ def create(sender, recipients=None, cc=None, bcc=None, subject='', message='',
         )
         if template:
             email.template=template
-        
+
+    if validated:
+        email.mark_validated('from_email', 'to', 'cc', 'bcc')
+
     if commit:
         email.save()
+        if status == STATUS.queued:
+            notify()
+            count_emails('emails_enqueued', [email])
 
     return email
 
@@ -110,6 +141,11 @@ def send(recipients=None, sender=None, template=None, context=None, subject='',
     if sender is None:
         sender = settings.DEFAULT_FROM_EMAIL
 
+    try:
+        validate_email_with_name(sender)
+    except ValidationError as e:
+        raise ValidationError('sender: %s' % e.message)
+
     priority = parse_priority(priority)
 
     if log_level is None:
@@ -144,7 +180,8 @@ def send(recipients=None, sender=None, template=None, context=None, subject='',
 
     email = create(sender, recipients, cc, bcc, subject, message, html_message,
                    context, scheduled_time, headers, template, priority,
-                   render_on_delivery, commit=commit, backend=backend)
+                   render_on_delivery, commit=commit, backend=backend,
+                   validated=True)
 
     if attachments:
         attachments = create_attachments(attachments)
@@ -165,64 +202,339 @@ def send_many(kwargs_list):
     emails = []
     for kwargs in kwargs_list:
         emails.append(send(commit=False, **kwargs))
-    Email.objects.bulk_create(emails)
+    _bulk_create_emails(emails)
+    if emails:
+        notify()
+        count_emails('emails_enqueued', emails)
 
 
-def get_queued():
+def send_stream(kwargs_iterable, chunk_size=500, attachments=None):
     """
-    Returns a list of emails that should be sent:
-     - Status is queued
+    Similar to send_many(), but ``kwargs_iterable`` is consumed lazily and
+    emails are validated, rendered and inserted ``chunk_size`` at a time, one
+    transaction per chunk, so memory use doesn't grow with the number of
+    recipients.
+
+    ``attachments`` are shared by all emails, either a dict of files as
+    accepted by mail.send() or a list of existing ``Attachment`` instances.
+    Returns the number of queued emails.
+    """
+    if isinstance(attachments, dict):
+        attachments = create_attachments(attachments)
+    attachments = list(attachments or [])
+
+    count = 0
+    for chunk in chunked(kwargs_iterable, chunk_size):
+        with transaction.atomic():
+            emails = [send(commit=False, **kwargs) for kwargs in chunk]
+            _bulk_create_emails(emails, attachments)
+            notify()
+        count_emails('emails_enqueued', emails)
+        count += len(emails)
+
+    return count
+
+
+def _bulk_create_emails(emails, attachments=None, email_attachments=None):
+    """
+    Inserts unsaved emails, linking each of them to ``attachments`` and to
+    its own attachments in ``email_attachments``, a list of attachment lists
+    in the order of ``emails``.
+    """
+    store_email_bodies(emails)
+    if not attachments and not any(email_attachments or []):
+        Email.objects.bulk_create(emails)
+        return
+
+    # Linking attachments requires primary keys, which bulk_create() only
+    # sets on databases that can return them
+    if getattr(db_connection.features, 'can_return_ids_from_bulk_insert', False):
+        Email.objects.bulk_create(emails)
+    else:
+        for email in emails:
+            email.save()
+
+    attachments = attachments or []
+    email_attachments = email_attachments or [[]] * len(emails)
+    Through = Attachment.emails.through
+    Through.objects.bulk_create([
+        Through(email_id=email.id, attachment_id=attachment.id)
+        for email, own_attachments in zip(emails, email_attachments)
+        for attachment in attachments + list(own_attachments)
+    ])
+
+
+def get_queued_filter():
+    """
+    Returns a ``Q`` object matching emails that are due to be sent:
+     - Status is queued, or status is sending but its claim has expired
      - Has scheduled_time lower than the current time or None
     """
-    return Email.objects.filter(status=STATUS.queued) \
-        .select_related('template') \
-        .filter(Q(scheduled_time__lte=now()) | Q(scheduled_time=None)) \
-        .order_by(*get_sending_order()).prefetch_related('attachments')[:get_batch_size()]
+    current_time = now()
+    lease_expiry = current_time - timedelta(seconds=get_claim_lease())
+    return (
+        (Q(status=STATUS.queued) |
+         Q(status=STATUS.sending, claimed_at__lt=lease_expiry)) &
+        (Q(scheduled_time__lte=current_time) | Q(scheduled_time=None))
+    )
 
 
-def send_queued(processes=1, log_level=None):
+def get_queued_querysets(priorities=None):
     """
-    Sends out all queued mails that has scheduled_time less than now or None
+    Returns querysets that together match the same emails as
+    ``get_queued_filter()``, limited to ``priorities`` if given. Each is a
+    plain conjunction that can be served by the queue index, where the OR
+    conditions of the filter would make most databases fall back to
+    scanning the status index.
     """
-    queued_emails = get_queued()
-    total_sent, total_failed = 0, 0
-    total_email = len(queued_emails)
+    current_time = now()
+    lease_expiry = current_time - timedelta(seconds=get_claim_lease())
+    querysets = [
+        Email.objects.filter(status=STATUS.queued, scheduled_time=None),
+        Email.objects.filter(status=STATUS.queued, scheduled_time__lte=current_time),
+        # Emails are only claimed once due, so their scheduled_time is
+        # not checked again when the claim expires
+        Email.objects.filter(status=STATUS.sending, claimed_at__lt=lease_expiry),
+    ]
+    if priorities is not None:
+        querysets = [queryset.filter(priority__in=priorities)
+                     for queryset in querysets]
+    return querysets
+
+
+def claim_queued(priorities=None):
+    """
+    Atomically claims a batch of due emails for this worker and returns
+    their ids. Claimed emails are marked as ``sending`` so that other
+    workers, on this or any other host, skip them until they are sent,
+    failed or their claim expires after ``CLAIM_LEASE`` seconds. Only
+    emails with one of ``priorities`` are claimed if given.
+    """
+    claimed_by = '%s:%s:%s' % (socket.gethostname()[:200], os.getpid(), uuid4().hex)
+
+    batch_size = get_batch_size()
+    sending_order = get_sending_order()
+    skip_locked = getattr(db_connection.features,
+                          'has_select_for_update_skip_locked', False)
+
+    with transaction.atomic():
+        email_ids = []
+        for queryset in get_queued_querysets(priorities):
+            queryset = queryset.order_by(*sending_order)
+            # Rows locked by other workers are skipped instead of waited on
+            if skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            email_ids.extend(queryset.values_list('id', flat=True)[:batch_size])
+
+        if not email_ids:
+            return []
+
+        # Keep the first emails in sending order across the querysets
+        if len(email_ids) > batch_size:
+            email_ids = list(Email.objects.filter(id__in=email_ids)
+                             .order_by(*sending_order)
+                             .values_list('id', flat=True)[:batch_size])
+
+        # The queued filter is repeated so that on databases without
+        # SKIP LOCKED, an email claimed by a concurrent worker in the
+        # meantime is not claimed twice
+        Email.objects.filter(get_queued_filter(), id__in=email_ids) \
+            .update(status=STATUS.sending, claimed_by=claimed_by,
+                    claimed_at=now())
+
+    return list(Email.objects.filter(id__in=email_ids, claimed_by=claimed_by)
+                .values_list('id', flat=True))
+
+
+def get_queued(priorities=None):
+    """
+    Claims and returns a list of emails that should be sent:
+     - Status is queued, or status is sending but its claim has expired
+     - Has scheduled_time lower than the current time or None
+     - Has one of ``priorities`` if given
+
+    Bodies, context and headers are deferred. Call ``load_heavy_fields()``
+    before accessing them, otherwise each email loads them with a few
+    queries of its own.
+    """
+    email_ids = claim_queued(priorities)
+    if not email_ids:
+        return []
+    return list(Email.objects.filter(id__in=email_ids)
+                .defer(*HEAVY_FIELDS)
+                .select_related('template')
+                .order_by(*get_sending_order())
+                .prefetch_related('attachments'))
+
+
+def load_heavy_fields(emails):
+    """
+    Loads the deferred ``HEAVY_FIELDS`` of ``emails``, and their stored
+    bodies, with a few queries for all of them instead of a few per email.
+    """
+    deferred_emails = [email for email in emails if email.get_deferred_fields()]
+    for chunk in chunked(deferred_emails, ID_CHUNK_SIZE):
+        loaded_emails = Email.objects.only(*HEAVY_FIELDS) \
+            .in_bulk([email.id for email in chunk])
+        for email in chunk:
+            loaded_email = loaded_emails.get(email.id)
+            if loaded_email is None:
+                continue
+            for attname in email.get_deferred_fields():
+                if attname in loaded_email.__dict__:
+                    email.__dict__[attname] = loaded_email.__dict__[attname]
+
+    body_fields = [field for field in Email._meta.concrete_fields
+                   if getattr(field, 'body_field', None)]
+    body_ids = set(getattr(email, field.body_field + '_id')
+                   for email in emails for field in body_fields)
+    body_ids.discard(None)
+    bodies = {}
+    for chunk in chunked(body_ids, ID_CHUNK_SIZE):
+        bodies.update(EmailBody.objects.in_bulk(chunk))
+    for email in emails:
+        for field in body_fields:
+            body = bodies.get(getattr(email, field.body_field + '_id'))
+            if body is not None and not email.__dict__.get(field.attname):
+                setattr(email, field.body_field, body)
+                # Deferred attributes of Django < 1.10 bypass the
+                # StoredBodyField descriptor
+                email.__dict__[field.attname] = body.text
 
-    logger.info('Started sending %s emails with %s processes.' %
-                (total_email, processes))
 
+def create_process_pool(processes):
+    """
+    Returns a pool of ``processes`` sending processes, that can be passed to
+    several ``send_queued()`` calls to avoid forking new processes for each
+    batch.
+    """
+    # Database connections must not be shared with the forked processes,
+    # each process opens its own when it first needs one
+    db_connections.close_all()
+    return Pool(processes)
+
+
+def send_queued(processes=1, log_level=None, close_connections=True, pool=None,
+                priorities=None, profile_dir=None):
+    """
+    Sends out all queued mails that has scheduled_time less than now or None
+
+    When ``close_connections`` is False and a single process is used, backend
+    connections are left open so they can be reused by the next batch.
+
+    With several processes, the ids of the claimed emails are put in a queue
+    in small chunks, which the processes of ``pool`` (or of a pool created
+    for this batch) fetch and send, so that faster processes take more of
+    the batch.
+
+    ``priorities`` limits the batch to emails with these priorities, so that
+    workers can be dedicated to some priorities.
+
+    If ``profile_dir`` is given, the sending of the batch, or of each chunk
+    with several processes, is profiled and written to a file in it.
+    """
     if log_level is None:
         log_level = get_log_level()
 
-    if queued_emails:
-
-        # Don't use more processes than number of emails
-        if total_email < processes:
-            processes = total_email
+    metrics = get_metrics()
+    if metrics.enabled:
+        record_queue_depth(metrics)
 
-        if processes == 1:
-            total_sent, total_failed = _send_bulk(queued_emails,
-                                                  uses_multiprocessing=False,
-                                                  log_level=log_level)
-        else:
-            email_lists = split_emails(queued_emails, processes)
+    total_sent, total_failed = 0, 0
 
-            pool = Pool(processes)
-            results = pool.map(_send_bulk, email_lists)
-            pool.terminate()
+    if processes == 1 and pool is None:
+        with profiled(profile_dir) as discard_profile:
+            timings = {}
+            with measure_batch(timings, 'fetch'):
+                queued_emails = get_queued(priorities)
+            if not queued_emails:
+                # An idle daemon would write a profile on every poll
+                discard_profile()
+            total_email = len(queued_emails)
+            logger.info('Started sending %s emails with %s processes.' %
+                        (total_email, processes))
+            if queued_emails:
+                total_sent, total_failed = _send_bulk(queued_emails,
+                                                      uses_multiprocessing=False,
+                                                      log_level=log_level,
+                                                      close_connections=close_connections,
+                                                      timings=timings)
+    else:
+        email_ids = claim_queued(priorities)
+        total_email = len(email_ids)
+        logger.info('Started sending %s emails with %s processes.' %
+                    (total_email, processes))
+        if email_ids:
+            total_sent, total_failed = _send_in_processes(email_ids, processes,
+                                                          log_level, pool,
+                                                          profile_dir)
 
-            total_sent = sum([result[0] for result in results])
-            total_failed = sum([result[1] for result in results])
     message = '%s emails attempted, %s sent, %s failed' % (
         total_email,
         total_sent,
         total_failed
     )
     logger.info(message)
+    metrics.flush()
     return (total_sent, total_failed)
 
 
-def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
+def record_queue_depth(metrics):
+    """
+    Sets the ``queue_depth`` gauge of each priority to its number of queued
+    emails.
+    """
+    counts = dict(Email.objects.filter(status=STATUS.queued).order_by()
+                  .values_list('priority').annotate(Count('id')))
+    for priority, name in enumerate(PRIORITY._fields):
+        metrics.gauge('queue_depth', counts.get(priority, 0), {'priority': name})
+
+
+def _send_in_processes(email_ids, processes, log_level, pool=None,
+                       profile_dir=None):
+    # Chunks are small enough to be spread across processes, but large
+    # enough to keep the threads of a process busy
+    chunk_size = max(get_threads_per_process(),
+                     int(math.ceil(len(email_ids) / (processes * 4.0))))
+    tasks = [(chunk, log_level, profile_dir)
+             for chunk in chunked(email_ids, chunk_size)]
+
+    created_pool = pool is None
+    if created_pool:
+        # Don't use more processes than chunks of emails
+        pool = create_process_pool(min(processes, len(tasks)))
+    try:
+        results = list(pool.imap_unordered(_send_queued_ids, tasks))
+    finally:
+        if created_pool:
+            pool.terminate()
+
+    return (sum(result[0] for result in results),
+            sum(result[1] for result in results))
+
+
+def _send_queued_ids(task):
+    """
+    Sends claimed emails from a worker process of ``send_queued()``.
+    """
+    email_ids, log_level, profile_dir = task
+    # The process outlives a batch, don't reuse a connection that the
+    # database closed in the meantime
+    close_old_connections()
+    with profiled(profile_dir):
+        timings = {}
+        with measure_batch(timings, 'fetch'):
+            emails = list(Email.objects.filter(id__in=email_ids)
+                          .defer(*HEAVY_FIELDS)
+                          .select_related('template')
+                          .prefetch_related('attachments'))
+        # Backend connections are kept open for the next chunk
+        return _send_bulk(emails, uses_multiprocessing=False, log_level=log_level,
+                          close_connections=False, timings=timings)
+
+
+def _send_bulk(emails, uses_multiprocessing=True, log_level=None,
+               close_connections=True, timings=None):
     # Multiprocessing does not play well with database connection
     # Fix: Close connections on forking process
     # https://groups.google.com/forum/#!topic/django-users/eCAIY9DAfG0
@@ -232,8 +544,10 @@ def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
     if log_level is None:
         log_level = get_log_level()
 
-    sent_emails = []
-    failed_emails = []  # This is a list of two tuples (email, exception)
+    if timings is None:
+        timings = {}
+
+    sent_count, failed_count = 0, 0
     email_count = len(emails)
 
     logger.info('Process started, sending %s emails' % email_count)
@@ -242,66 +556,188 @@ def _send_bulk(emails, uses_multiprocessing=True, log_level=None):
         try:
             email.dispatch(log_level=log_level, commit=False,
                            disconnect_after_delivery=False)
-            sent_emails.append(email)
             logger.debug('Successfully sent email #%d' % email.id)
+            return email, None
         except Exception as e:
             logger.debug('Failed to send email #%d' % email.id)
-            failed_emails.append((email, e))
-
-    # Prepare emails before we send these to threads for sending
-    # So we don't need to access the DB from within threads
-    for email in emails:
-        # Sometimes this can fail, for example when trying to render
-        # email from a faulty Django template
-        try:
-            email.prepare_email_message()
-        except Exception as e:
-            failed_emails.append((email, e))
+            return email, e
 
-    number_of_threads = min(get_threads_per_process(), email_count)
-    pool = ThreadPool(number_of_threads)
-
-    pool.map(send, emails)
-    pool.close()
-    pool.join()
-
-    connections.close()
+    sent_emails = []
+    failed_emails = []  # This is a list of two tuples (email, exception)
 
-    # Update statuses of sent and failed emails
-    email_ids = [email.id for email in sent_emails]
-    Email.objects.filter(id__in=email_ids).update(status=STATUS.sent)
+    # Emails that would exceed a rate limit are put back in the queue
+    # instead of being sent and rejected by the provider
+    if get_backend_rate_limits() or get_domain_rate_limits():
+        emails_to_send = _apply_rate_limits(emails)
+    else:
+        emails_to_send = emails
 
-    email_ids = [email.id for (email, e) in failed_emails]
-    Email.objects.filter(id__in=email_ids).update(status=STATUS.failed)
+    # Bodies are only loaded for the emails sent by this batch
+    with measure_batch(timings, 'load'):
+        load_heavy_fields(emails_to_send)
 
-    # If log level is 0, log nothing, 1 logs only sending failures
-    # and 2 means log both successes and failures
-    if log_level >= 1:
+    # Prepare emails before we send these to threads for sending
+    # So we don't need to access the DB from within threads
+    # Attachments shared by several emails are only read once per batch
+    attachment_cache = AttachmentCache()
+    prepared_emails = []
+    with measure_batch(timings, 'prepare'):
+        for email in emails_to_send:
+            # Sometimes this can fail, for example when trying to render
+            # email from a faulty Django template
+            try:
+                # Messages are sent through the backend's connection pool, which
+                # hands each thread its own connection
+                pool = connections.get_pool(email.backend_alias or 'default')
+                email.prepare_email_message(attachment_cache=attachment_cache,
+                                            connection=pool)
+                prepared_emails.append(email)
+            except Exception as e:
+                failed_emails.append((email, e))
+        attachment_cache.close()
+
+    # Results are collected in this thread, which also writes them to the
+    # database every STATUS_UPDATE_INTERVAL messages if configured so that
+    # a crash mid-batch doesn't cause the whole batch to be sent again
+    update_interval = get_status_update_interval()
+
+    # The send stage includes the intermediate status updates, which are
+    # also counted in the update stage
+    if prepared_emails:
+        with measure_batch(timings, 'send'):
+            if get_sending_engine() == 'asyncio':
+                from .aio import send_emails
+                pool = None
+                results = send_emails(prepared_emails)
+            else:
+                number_of_threads = min(get_threads_per_process(), len(prepared_emails))
+                pool = ThreadPool(number_of_threads)
+                results = pool.imap_unordered(send, prepared_emails)
+
+            for email, exception in results:
+                if exception is None:
+                    sent_emails.append(email)
+                else:
+                    failed_emails.append((email, exception))
+
+                if update_interval and \
+                        len(sent_emails) + len(failed_emails) >= update_interval:
+                    with measure_batch(timings, 'update'):
+                        _update_statuses(sent_emails, failed_emails, log_level)
+                    sent_count += len(sent_emails)
+                    failed_count += len(failed_emails)
+                    sent_emails, failed_emails = [], []
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    if close_connections:
+        connections.close()
+
+    with measure_batch(timings, 'update'):
+        _update_statuses(sent_emails, failed_emails, log_level)
+    sent_count += len(sent_emails)
+    failed_count += len(failed_emails)
+
+    # Emails deferred by rate limits are left out, they weren't sent
+    batch_sent.send(sender=Email, emails=emails_to_send, timings=timings)
 
-        logs = []
-        for (email, exception) in failed_emails:
-            logs.append(
-                Log(email=email, status=STATUS.failed,
-                    message=str(exception),
-                    exception_type=type(exception).__name__)
-            )
+    logger.info(
+        'Process finished, %s attempted, %s sent, %s failed' % (
+            email_count, sent_count, failed_count
+        )
+    )
 
-        if logs:
-            Log.objects.bulk_create(logs)
+    return sent_count, failed_count
 
-    if log_level == 2:
 
+def _apply_rate_limits(emails):
+    """
+    Returns the emails that can be sent within the configured rate limits.
+    The others are queued again, scheduled for when their limit resets.
+    """
+    rate_limiter = RateLimiter()
+    allowed_emails = []
+    deferred_emails = []
+    deferred_ids = defaultdict(list)
+    for email in emails:
+        delay = rate_limiter.acquire(email)
+        if delay is None:
+            allowed_emails.append(email)
+        else:
+            deferred_emails.append(email)
+            deferred_ids[int(math.ceil(delay))].append(email.id)
+
+    if deferred_ids:
+        count_emails('emails_deferred', deferred_emails)
+        logger.info('Deferred %s emails exceeding rate limits' %
+                    sum(len(ids) for ids in deferred_ids.values()))
+        current_time = now()
+        with transaction.atomic():
+            for delay, email_ids in deferred_ids.items():
+                for chunk in chunked(email_ids, ID_CHUNK_SIZE):
+                    Email.objects.filter(id__in=chunk).update(
+                        status=STATUS.queued, claimed_by='', claimed_at=None,
+                        scheduled_time=current_time + timedelta(seconds=delay))
+    return allowed_emails
+
+
+def _update_statuses(sent_emails, failed_emails, log_level):
+    """
+    Records the statuses and logs of delivered emails in one transaction.
+    ``failed_emails`` is a list of two tuples (email, exception). Emails
+    that failed with a transient error are queued again with an exponential
+    backoff, until they failed ``MAX_RETRIES`` times.
+    """
+    max_retries = get_max_retries()
+    retried_emails = []
+    given_up_emails = []
+    for (email, exception) in failed_emails:
+        if email.number_of_retries < max_retries and is_transient_error(exception):
+            retried_emails.append(email)
+        else:
+            given_up_emails.append(email)
+    email_ids = [email.id for email in given_up_emails]
+
+    count_emails('emails_sent', sent_emails)
+    observe_delivery(sent_emails)
+    count_emails('emails_failed', given_up_emails)
+    count_emails('emails_retried', retried_emails)
+
+    with transaction.atomic():
+        # Keep "id IN (...)" lists under the parameter limits of
+        # databases such as SQLite and Oracle
+        for chunk in chunked(email_ids, ID_CHUNK_SIZE):
+            Email.objects.filter(id__in=chunk).update(status=STATUS.failed)
+
+        email_ids = [email.id for email in sent_emails]
+        for chunk in chunked(email_ids, ID_CHUNK_SIZE):
+            Email.objects.filter(id__in=chunk).update(status=STATUS.sent)
+
+        # Each retried email gets its own randomized delay
+        current_time = now()
+        for email in retried_emails:
+            delay = get_retry_delay(email.number_of_retries)
+            Email.objects.filter(id=email.id).update(
+                status=STATUS.queued, claimed_by='', claimed_at=None,
+                scheduled_time=current_time + timedelta(seconds=delay),
+                number_of_retries=F('number_of_retries') + 1)
+
+        # If log level is 0, log nothing, 1 logs only sending failures
+        # and 2 means log both successes and failures
         logs = []
-        for email in sent_emails:
-            logs.append(Log(email=email, status=STATUS.sent))
+        if log_level >= 1:
+            for (email, exception) in failed_emails:
+                logs.append(
+                    Log(email=email, status=STATUS.failed,
+                        message=str(exception),
+                        exception_type=type(exception).__name__)
+                )
+
+        if log_level == 2:
+            for email in sent_emails:
+                logs.append(Log(email=email, status=STATUS.sent))
 
         if logs:
             Log.objects.bulk_create(logs)
-
-    logger.info(
-        'Process finished, %s attempted, %s sent, %s failed' % (
-            email_count, len(sent_emails), len(failed_emails)
-        )
-    )
-
-    return len(sent_emails), len(failed_emails)
@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from ...archive import archive_emails
+
+
+class Command(BaseCommand):
+    help = 'Move sent and failed mails to the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-d', '--days',
+            type=int,
+            default=30,
+            help="Archive mails last updated more than this many days ago, defaults to 30."
+            )
+        parser.add_argument('-b', '--batch-size',
+            type=int,
+            default=500,
+            help="Number of mails moved per transaction, defaults to 500."
+            )
+
+    def handle(self, verbosity, days, batch_size, **options):
+        cutoff_date = now() - datetime.timedelta(days)
+        count = archive_emails(cutoff_date, batch_size=batch_size)
+        print("Archived {0} mails last updated before {1} ".format(count, cutoff_date))
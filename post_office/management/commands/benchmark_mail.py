@@ -0,0 +1,109 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...benchmark import (BACKENDS, TEMPLATES, SMTPStub, Stage,
+                          get_scenarios, run_scenario)
+from ...settings import get_threads_per_process
+
+
+class Command(BaseCommand):
+    help = ('Measure the throughput of sending mails, in a test database. '
+            'Options can be repeated to compare several values.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--count',
+            type=int,
+            action='append',
+            help="Number of mails sent, defaults to 100."
+            )
+        parser.add_argument('-r', '--recipients',
+            type=int,
+            action='append',
+            help="Number of recipients per mail, defaults to 1."
+            )
+        parser.add_argument('-a', '--attachment-size',
+            type=int,
+            action='append',
+            help="Size in bytes of the attachment of each mail, defaults to 0 "
+                 "(no attachment)."
+            )
+        parser.add_argument('-t', '--template',
+            action='append',
+            choices=sorted(TEMPLATES),
+            help="Template rendered for each mail, defaults to none."
+            )
+        parser.add_argument('-p', '--processes',
+            type=int,
+            action='append',
+            help="Number of sending processes, defaults to 1."
+            )
+        parser.add_argument('--threads',
+            type=int,
+            action='append',
+            help="Number of sending threads per process, defaults to THREADS_PER_PROCESS."
+            )
+        parser.add_argument('-b', '--backend',
+            action='append',
+            choices=sorted(BACKENDS),
+            help="Backend the mails are sent with, defaults to locmem. The smtp "
+                 "backend sends to a local server discarding the mails."
+            )
+        parser.add_argument('--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            default=True,
+            help="Don't ask before deleting an existing test database."
+            )
+
+    def handle(self, verbosity, count, recipients, attachment_size, template,
+               processes, threads, backend, interactive, **options):
+        scenarios = get_scenarios(count or [100], recipients or [1],
+                                  attachment_size or [0], template or ['none'],
+                                  processes or [1],
+                                  threads or [get_threads_per_process()],
+                                  backend or ['locmem'])
+
+        # Per email log lines would be part of the measured time
+        if verbosity < 2:
+            logging.getLogger('post_office').setLevel(logging.WARNING)
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=max(verbosity - 1, 0),
+                                           autoclobber=not interactive,
+                                           serialize=False)
+        smtp_stub = None
+        try:
+            test_name = connection.settings_dict['NAME']
+            # Forked processes can't see an in-memory database
+            if (any(scenario.processes > 1 for scenario in scenarios) and
+                    (test_name == ':memory:' or 'mode=memory' in test_name)):
+                raise CommandError(
+                    "Several processes can't share an in-memory SQLite test "
+                    "database, set DATABASES['default']['TEST']['NAME'].")
+
+            if any(scenario.backend == 'smtp' for scenario in scenarios):
+                smtp_stub = SMTPStub()
+                smtp_stub.start()
+
+            for scenario in scenarios:
+                print(', '.join('%s=%s' % item for item in zip(scenario._fields, scenario)))
+                stages = run_scenario(scenario, smtp_stub)
+                for stage in stages:
+                    self.print_stage(stage)
+                # From the call to send() to the delivery
+                self.print_stage(Stage('end to end', scenario.count, sum(
+                    stage.seconds for stage in stages
+                    if stage.name in ('send', 'send_queued')), 0))
+        finally:
+            if smtp_stub is not None:
+                smtp_stub.stop()
+            connection.creation.destroy_test_db(old_name, max(verbosity - 1, 0))
+
+    def print_stage(self, stage):
+        rate = stage.rate
+        print("  {0:<12} {1:>10.3f}s {2:>10} mails/s{3}".format(
+            stage.name, stage.seconds,
+            '-' if rate is None else '%.1f' % rate,
+            ' ({0} failed)'.format(stage.failed) if stage.failed else ''))
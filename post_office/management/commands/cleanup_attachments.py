@@ -0,0 +1,102 @@
+import datetime
+import os
+from multiprocessing.dummy import Pool as ThreadPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import Attachment
+from ...utils import chunked, delete_orphaned_attachments, get_unused_files
+
+# Directory attachments are uploaded to, see models.get_upload_path()
+UPLOAD_DIRECTORY = 'post_office_attachments'
+
+
+def iter_files(storage, path):
+    """
+    Yields the names of the files under ``path`` in ``storage``, listing one
+    directory at a time.
+    """
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name).replace(os.sep, '/')
+    for directory in directories:
+        for name in iter_files(storage, os.path.join(path, directory)):
+            yield name
+
+
+def get_modified_time(storage, name):
+    try:
+        return storage.get_modified_time(name)
+    except AttributeError:
+        # Django < 1.10 only has naive modified times
+        modified_time = storage.modified_time(name)
+        if settings.USE_TZ:
+            modified_time = timezone.make_aware(modified_time)
+        return modified_time
+
+
+class Command(BaseCommand):
+    help = 'Delete attachments not linked to any mail and files without an attachment.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size',
+            type=int,
+            default=500,
+            help="Number of attachments or files checked per query, defaults to 500."
+            )
+        parser.add_argument('-w', '--workers',
+            type=int,
+            default=4,
+            help="Number of threads deleting files from storage, defaults to 4."
+            )
+        parser.add_argument('--min-age',
+            type=int,
+            default=60,
+            help="Keep attachments created or reused, and files without an "
+                 "attachment modified, less than this many minutes ago, as they "
+                 "may belong to a mail being created. Defaults to 60."
+            )
+        parser.add_argument('--dry-run',
+            action='store_true',
+            default=False,
+            help="Only report what would be deleted."
+            )
+
+    def handle(self, verbosity, batch_size, workers, min_age, dry_run, **options):
+        storage = Attachment._meta.get_field('file').storage
+        pool = ThreadPool(workers)
+        try:
+            cutoff_date = timezone.now() - datetime.timedelta(minutes=min_age)
+            if dry_run:
+                count = Attachment.objects.filter(emails=None, archived_emails=None,
+                                                  last_used__lt=cutoff_date).count()
+            else:
+                count = delete_orphaned_attachments(Attachment.objects.all(),
+                                                    batch_size, pool, min_age)
+            print("{0} {1} attachments not linked to any mail".format(
+                'Found' if dry_run else 'Deleted', count))
+
+            if not storage.exists(UPLOAD_DIRECTORY):
+                return
+
+            def is_stale(name):
+                return get_modified_time(storage, name) < cutoff_date
+
+            count = 0
+            for names in chunked(iter_files(storage, UPLOAD_DIRECTORY), batch_size):
+                names = sorted(get_unused_files(names))
+                names = [name for name, stale in zip(names, pool.map(is_stale, names))
+                         if stale]
+                count += len(names)
+                if verbosity > 1:
+                    for name in names:
+                        print(name)
+                if not dry_run:
+                    pool.map(storage.delete, names)
+            print("{0} {1} files without an attachment".format(
+                'Found' if dry_run else 'Deleted', count))
+        finally:
+            pool.close()
+            pool.join()
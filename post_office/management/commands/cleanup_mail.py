@@ -1,13 +1,17 @@
 import datetime
+import time
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils.timezone import now
 
-from ...models import Email
+from ...models import ArchivedEmail, Attachment, Email, STATUS
+from ...utils import (chunked, delete_archived_emails, delete_emails,
+                      delete_orphaned_attachments, delete_orphaned_bodies)
 
 
 class Command(BaseCommand):
-    help = 'Place deferred messages back in the queue.'
+    help = 'Delete mails older than a number of days.'
 
     def add_arguments(self, parser):
         parser.add_argument('-d', '--days',
@@ -15,11 +19,77 @@ class Command(BaseCommand):
             default=90,
             help="Cleanup mails older than this many days, defaults to 90."
             )
+        parser.add_argument('-b', '--batch-size',
+            type=int,
+            default=500,
+            help="Number of mails deleted per query, defaults to 500."
+            )
+        parser.add_argument('-s', '--sleep',
+            type=float,
+            default=0,
+            help="Seconds to wait between batches, to leave room to the sender."
+            )
+        parser.add_argument('--status',
+            action='append',
+            choices=['sent', 'failed'],
+            help="Only delete mails with this status, can be repeated. "
+                 "Queued mails are never deleted."
+            )
+        parser.add_argument('--delete-attachments',
+            action='store_true',
+            default=False,
+            help="Also delete attachments, and their files, no longer linked to any mail."
+            )
 
-    def handle(self, verbosity, days, **options):
-        # Delete mails and their related logs and queued created before X days
-
+    def handle(self, verbosity, days, batch_size, sleep, status,
+               delete_attachments, **options):
         cutoff_date = now() - datetime.timedelta(days)
-        count = Email.objects.filter(created__lt=cutoff_date).count()
-        Email.objects.only('id').filter(created__lt=cutoff_date).delete()
+
+        # Attachments linked to the deleted mails may become orphaned
+        attachment_ids = set()
+        count = 0
+        for model in (Email, ArchivedEmail):
+            queryset = model.objects.filter(created__lt=cutoff_date) \
+                .exclude(status__in=[STATUS.queued, STATUS.sending])
+            if status:
+                queryset = queryset.filter(status__in=[getattr(STATUS, name)
+                                                       for name in status])
+            queryset = queryset.order_by('id').values_list('id', flat=True)
+            # Walk the primary key range so that each batch is a cheap
+            # index range scan and no long running transaction is held
+            last_id = 0
+            while True:
+                email_ids = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not email_ids:
+                    break
+                last_id = email_ids[-1]
+                with transaction.atomic():
+                    # Mails requeued since they were listed are kept
+                    email_ids = list(queryset.select_for_update()
+                                     .filter(id__in=email_ids))
+                    if delete_attachments:
+                        attachment_ids.update(
+                            model.attachments.through.objects
+                            .filter(**{'%s_id__in' % model._meta.model_name: email_ids})
+                            .values_list('attachment_id', flat=True))
+                    if model is Email:
+                        count += delete_emails(email_ids)
+                    else:
+                        count += delete_archived_emails(email_ids)
+                if sleep:
+                    time.sleep(sleep)
+
         print("Deleted {0} mails created before {1} ".format(count, cutoff_date))
+
+        # Stored bodies may no longer be used, e.g. by the deleted mails
+        deleted = delete_orphaned_bodies(batch_size)
+        if deleted:
+            print("Deleted {0} message bodies".format(deleted))
+
+        if delete_attachments:
+            deleted = 0
+            for chunk in chunked(sorted(attachment_ids), batch_size):
+                deleted += delete_orphaned_attachments(
+                    Attachment.objects.filter(id__in=chunk), batch_size)
+            print("Deleted {0} attachments".format(deleted))
+
@@ -3,13 +3,14 @@ import sys
 
 from django.core.management.base import BaseCommand
 from django.db import connection
-from django.db.models import Q
-from django.utils.timezone import now
 
+from ...daemon import Daemon, run_lanes
 from ...lockfile import FileLock, FileLocked
-from ...mail import send_queued
-from ...models import Email, STATUS
+from ...mail import get_queued_querysets, send_queued
 from ...logutils import setup_loghandlers
+from ...models import PRIORITY
+from ...settings import get_priority_lanes
+from ...utils import parse_priority
 
 
 logger = setup_loghandlers()
@@ -34,17 +35,57 @@ class Command(BaseCommand):
             type=int,
             help='"0" to log nothing, "1" to only log errors',
         )
+        parser.add_argument(
+            '-d', '--daemon',
+            action='store_true',
+            default=False,
+            help='Keep running and polling for queued emails until SIGTERM',
+        )
+        parser.add_argument(
+            '--priority',
+            action='append',
+            choices=PRIORITY._fields,
+            help='Only send emails with this priority, can be repeated',
+        )
+        parser.add_argument(
+            '--profile',
+            nargs='?',
+            const=tempfile.gettempdir(),
+            metavar='DIRECTORY',
+            help='Write a cProfile dump of each batch to DIRECTORY, defaults '
+                 'to the temporary directory',
+        )
 
     def handle(self, *args, **options):
+        lockfile = options['lockfile']
+        priorities = None
+        if options.get('priority'):
+            priorities = [parse_priority(priority) for priority in options['priority']]
+            # Workers of different priorities don't exclude each other
+            if lockfile == default_lockfile:
+                lockfile += '_' + '_'.join(sorted(options['priority']))
+
         logger.info('Acquiring lock for sending queued emails at %s.lock' %
-                    options['lockfile'])
+                    lockfile)
         try:
-            with FileLock(options['lockfile']):
+            with FileLock(lockfile):
+
+                if options['daemon']:
+                    lanes = get_priority_lanes()
+                    if lanes and priorities is None:
+                        run_lanes(lanes, options.get('log_level'),
+                                  profile_dir=options.get('profile'))
+                    else:
+                        Daemon(options['processes'], options.get('log_level'),
+                               priorities, profile_dir=options.get('profile')).run()
+                    return
 
                 while 1:
                     try:
                         send_queued(options['processes'],
-                                    options.get('log_level'))
+                                    options.get('log_level'),
+                                    priorities=priorities,
+                                    profile_dir=options.get('profile'))
                     except Exception as e:
                         logger.error(e, exc_info=sys.exc_info(),
                                      extra={'status_code': 500})
@@ -53,8 +94,8 @@ class Command(BaseCommand):
                     # Close DB connection to avoid multiprocessing errors
                     connection.close()
 
-                    if not Email.objects.filter(status=STATUS.queued) \
-                            .filter(Q(scheduled_time__lte=now()) | Q(scheduled_time=None)).exists():
+                    if not any(queryset.exists()
+                               for queryset in get_queued_querysets(priorities)):
                         break
         except FileLocked:
             logger.info('Failed to acquire lock, terminating now.')
\ No newline at end of file
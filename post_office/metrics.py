@@ -0,0 +1,231 @@
+"""
+Sending metrics, recorded through the backend configured with
+``METRICS_BACKEND``:
+
+ - ``emails_enqueued``, ``emails_sent``, ``emails_failed``, ``emails_retried``
+   and ``emails_deferred`` counters, labelled with the backend alias and the
+   priority
+ - histograms of the duration of the stages of sending, see
+   ``post_office.instrumentation``, labelled with the backend alias for the
+   stages of emails
+ - a ``delivery_latency_seconds`` histogram of the time between the creation
+   and the delivery of emails, labelled with the backend alias and the
+   priority
+ - a ``queue_depth`` gauge of queued emails, labelled with the priority
+"""
+import os
+import socket
+from collections import Counter
+from threading import Lock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import now
+
+from .compat import import_attribute
+from .settings import get_metrics_backend, get_metrics_options
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class Metrics(object):
+    """
+    Discards metrics, used when ``METRICS_BACKEND`` isn't set. Durations are
+    given in seconds.
+    """
+    enabled = False
+
+    def increment(self, name, value=1, labels=None):
+        pass
+
+    def observe(self, name, value, labels=None):
+        pass
+
+    def gauge(self, name, value, labels=None):
+        pass
+
+    def flush(self):
+        """
+        Called after each batch of emails is sent.
+        """
+        pass
+
+
+class StatsDMetrics(Metrics):
+    """
+    Sends metrics to a StatsD server over UDP. Labels are appended to metric
+    names, or sent as DogStatsD tags if ``tags`` is True. Histograms are sent
+    as timers, in milliseconds.
+    """
+    enabled = True
+
+    def __init__(self, host='localhost', port=8125, prefix='post_office', tags=False):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tags = tags
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, name, value, metric_type, labels=None):
+        labels = sorted((labels or {}).items())
+        if self.prefix:
+            name = '%s.%s' % (self.prefix, name)
+        if labels and not self.tags:
+            name = '.'.join([name] + [label_value.replace('.', '_') or 'none'
+                                      for key, label_value in labels])
+        line = '%s:%s|%s' % (name, value, metric_type)
+        if labels and self.tags:
+            line += '|#' + ','.join('%s:%s' % label for label in labels)
+        return line
+
+    def send(self, line):
+        try:
+            self.socket.sendto(line.encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics must not interrupt sending
+            pass
+
+    def increment(self, name, value=1, labels=None):
+        self.send(self.format(name, value, 'c', labels))
+
+    def observe(self, name, value, labels=None):
+        self.send(self.format(name, int(round(value * 1000)), 'ms', labels))
+
+    def gauge(self, name, value, labels=None):
+        self.send(self.format(name, value, 'g', labels))
+
+
+# Deliveries can be delayed by hours by schedules, retries and rate limits
+HISTOGRAM_BUCKETS = {
+    'delivery_latency_seconds': (1, 5, 15, 30, 60, 300, 900, 1800, 3600,
+                                 3 * 3600, 6 * 3600, 24 * 3600),
+}
+
+
+class PrometheusMetrics(Metrics):
+    """
+    Records metrics with prometheus_client in ``registry``, defaulting to its
+    global registry. They are served over HTTP on ``port`` if given, and
+    written to ``textfile`` after each batch if given, for node_exporter's
+    textfile collector.
+
+    When prometheus_client's multiprocess mode is enabled, metrics of all the
+    sending processes are served and written.
+    """
+    enabled = True
+
+    def __init__(self, namespace='post_office', port=None, addr='', textfile=None,
+                 registry=None):
+        if prometheus_client is None:
+            raise ImproperlyConfigured(
+                'prometheus_client is required to use PrometheusMetrics')
+        self.namespace = namespace
+        self.registry = registry or prometheus_client.REGISTRY
+        self.textfile = textfile
+        self._metrics = {}
+        self._lock = Lock()
+        if port is not None:
+            prometheus_client.start_http_server(port, addr,
+                                                registry=self.get_exposed_registry())
+
+    def get_exposed_registry(self):
+        if 'prometheus_multiproc_dir' in os.environ or \
+                'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            from prometheus_client import multiprocess
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return registry
+        return self.registry
+
+    def get_metric(self, metric_class, name, labels, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = metric_class(
+                        name, name.replace('_', ' ').capitalize(),
+                        sorted(labels or ()), namespace=self.namespace,
+                        registry=self.registry, **kwargs)
+        if labels:
+            metric = metric.labels(**labels)
+        return metric
+
+    def increment(self, name, value=1, labels=None):
+        self.get_metric(prometheus_client.Counter, name, labels).inc(value)
+
+    def observe(self, name, value, labels=None):
+        buckets = HISTOGRAM_BUCKETS.get(name, prometheus_client.Histogram.DEFAULT_BUCKETS)
+        self.get_metric(prometheus_client.Histogram, name, labels,
+                        buckets=buckets).observe(value)
+
+    def gauge(self, name, value, labels=None):
+        # The queue depth is measured by the parent process
+        self.get_metric(prometheus_client.Gauge, name, labels,
+                        multiprocess_mode='max').set(value)
+
+    def flush(self):
+        if self.textfile:
+            prometheus_client.write_to_textfile(self.textfile,
+                                                self.get_exposed_registry())
+
+
+_null_metrics = Metrics()
+_metrics = {}
+_metrics_lock = Lock()
+
+
+def get_metrics():
+    """
+    Returns the metrics backend configured with ``METRICS_BACKEND`` and
+    ``METRICS_OPTIONS``, instantiated once per process and configuration.
+    """
+    backend = get_metrics_backend()
+    if not backend:
+        return _null_metrics
+    options = get_metrics_options()
+    key = (backend, repr(sorted(options.items())))
+    metrics = _metrics.get(key)
+    if metrics is None:
+        with _metrics_lock:
+            metrics = _metrics.get(key)
+            if metrics is None:
+                metrics = _metrics[key] = import_attribute(backend)(**options)
+    return metrics
+
+
+def get_labels(email):
+    from .models import PRIORITY
+    return {
+        'backend': email.backend_alias or 'default',
+        'priority': PRIORITY._fields[email.priority] if email.priority is not None else '',
+    }
+
+
+def count_emails(name, emails):
+    """
+    Increments the ``name`` counter by the number of ``emails`` of each
+    backend alias and priority.
+    """
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return
+    counts = Counter(tuple(sorted(get_labels(email).items())) for email in emails)
+    for labels, count in counts.items():
+        metrics.increment(name, count, dict(labels))
+
+
+def observe_delivery(emails):
+    """
+    Records the time elapsed since sent ``emails`` were created.
+    """
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return
+    current_time = now()
+    for email in emails:
+        if email.created is not None:
+            metrics.observe('delivery_latency_seconds',
+                            (current_time - email.created).total_seconds(),
+                            get_labels(email))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0009_emailtemplate_label'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Claimed at'),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='claimed_by',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Claimed by'),
+        ),
+        migrations.AlterField(
+            model_name='email',
+            name='status',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(0, 'sent'), (1, 'failed'), (2, 'queued'), (3, 'sending')], db_index=True, null=True, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0010_email_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='hash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='SHA-256 of the file content', max_length=64, verbose_name='Hash'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0011_attachment_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='number_of_retries',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of retries'),
+        ),
+    ]
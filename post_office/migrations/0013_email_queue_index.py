@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+INDEX_NAME = 'post_office_email_queue_idx'
+
+QUEUE_INDEX = ('status', 'priority', 'scheduled_time')
+
+# Values of STATUS.queued and STATUS.sending
+QUEUE_STATUSES = (2, 3)
+
+
+def create_queue_index(apps, schema_editor):
+    """
+    Creates the ``index_together`` index matching the queries of
+    ``get_queued_querysets()``. On PostgreSQL it is a partial index only
+    covering queued and sending emails, which stays small however many sent
+    emails are kept, and it is built concurrently so that the table isn't
+    locked for writes meanwhile.
+    """
+    Email = apps.get_model('post_office', 'Email')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_index_together(Email, set(), set([QUEUE_INDEX]))
+        return
+    quote_name = schema_editor.quote_name
+    # Migrations of Django < 1.10 always run in a transaction
+    concurrently = '' if schema_editor.connection.in_atomic_block else ' CONCURRENTLY'
+    schema_editor.execute('CREATE INDEX%s %s ON %s (%s) WHERE %s IN (%d, %d)' % (
+        concurrently, quote_name(INDEX_NAME), quote_name(Email._meta.db_table),
+        ', '.join(quote_name(column) for column in QUEUE_INDEX),
+        quote_name('status'), QUEUE_STATUSES[0], QUEUE_STATUSES[1]))
+
+
+def drop_queue_index(apps, schema_editor):
+    Email = apps.get_model('post_office', 'Email')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_index_together(Email, set([QUEUE_INDEX]), set())
+        return
+    concurrently = '' if schema_editor.connection.in_atomic_block else ' CONCURRENTLY'
+    schema_editor.execute('DROP INDEX%s %s' % (
+        concurrently, schema_editor.quote_name(INDEX_NAME)))
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('post_office', '0012_email_number_of_retries'),
+    ]
+
+    operations = [
+        # The index is part of the migration state, so that it's recreated
+        # when SQLite rebuilds the table
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_queue_index, drop_queue_index),
+            ],
+            state_operations=[
+                migrations.AlterIndexTogether(
+                    name='email',
+                    index_together=set([QUEUE_INDEX]),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import post_office.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0014_archivedemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBody',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(editable=False, max_length=64, unique=True, verbose_name='Hash')),
+                ('compression', models.CharField(editable=False, max_length=8, verbose_name='Compression')),
+                ('data', models.BinaryField(verbose_name='Data')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Email body',
+                'verbose_name_plural': 'Email bodies',
+            },
+        ),
+        # The columns don't change, only how their values are read and saved
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='archivedemail',
+                name='html_message',
+                field=post_office.fields.StoredBodyField(blank=True, body_field='html_message_body', verbose_name='HTML Message'),
+            ),
+            migrations.AlterField(
+                model_name='archivedemail',
+                name='message',
+                field=post_office.fields.StoredBodyField(blank=True, body_field='message_body', verbose_name='Message'),
+            ),
+            migrations.AlterField(
+                model_name='email',
+                name='html_message',
+                field=post_office.fields.StoredBodyField(blank=True, body_field='html_message_body', verbose_name='HTML Message'),
+            ),
+            migrations.AlterField(
+                model_name='email',
+                name='message',
+                field=post_office.fields.StoredBodyField(blank=True, body_field='message_body', verbose_name='Message'),
+            ),
+        ]),
+        migrations.AddField(
+            model_name='archivedemail',
+            name='html_message_body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='post_office.EmailBody'),
+        ),
+        migrations.AddField(
+            model_name='archivedemail',
+            name='message_body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='post_office.EmailBody'),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='html_message_body',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='post_office.EmailBody'),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='message_body',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='post_office.EmailBody'),
+        ),
+    ]
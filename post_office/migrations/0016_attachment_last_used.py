@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 01:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_office', '0015_email_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='last_used',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, help_text='When the attachment was created or last reused', verbose_name='Last used'),
+        ),
+    ]
@@ -2,27 +2,36 @@
 from __future__ import unicode_literals
 
 from collections import namedtuple
+from copy import copy
 from uuid import uuid4
 
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.db import models
-from django.template import Context, Template
+from django.template import Context
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.timezone import now
 from django.utils.translation import pgettext_lazy
 from django.utils.translation import ugettext_lazy as _
 from jsonfield import JSONField
 
 from post_office import cache
-from post_office.fields import CommaSeparatedEmailField
+from post_office.fields import CommaSeparatedEmailField, StoredBodyField
 
+from .bodies import decompress
 from .compat import text_type, smart_text
 from .connections import connections
+from .instrumentation import measure_email
+from .metrics import count_emails, observe_delivery
 from .settings import context_field_class, get_log_level
 from .validators import validate_email_with_name, validate_template_syntax
 
 
 PRIORITY = namedtuple('PRIORITY', 'low medium high now')._make(range(4))
-STATUS = namedtuple('STATUS', 'sent failed queued')._make(range(3))
+STATUS = namedtuple('STATUS', 'sent failed queued sending')._make(range(4))
+
+# Columns that can hold large values, only needed to send or display a
+# single email
+HEAVY_FIELDS = ('message', 'html_message', 'context', 'headers')
 
 
 @python_2_unicode_compatible
@@ -34,7 +43,7 @@ class Email(models.Model):
     PRIORITY_CHOICES = [(PRIORITY.low, _("low")), (PRIORITY.medium, _("medium")),
                         (PRIORITY.high, _("high")), (PRIORITY.now, _("now"))]
     STATUS_CHOICES = [(STATUS.sent, _("sent")), (STATUS.failed, _("failed")),
-                      (STATUS.queued, _("queued"))]
+                      (STATUS.queued, _("queued")), (STATUS.sending, _("sending"))]
 
     from_email = models.CharField(_("Email From"), max_length=254,
                                   validators=[validate_email_with_name])
@@ -42,12 +51,14 @@ class Email(models.Model):
     cc = CommaSeparatedEmailField(_("Cc"))
     bcc = CommaSeparatedEmailField(("Bcc"))
     subject = models.CharField(_("Subject"), max_length=989, blank=True)
-    message = models.TextField(_("Message"), blank=True)
-    html_message = models.TextField(_("HTML Message"), blank=True)
+    message = StoredBodyField(_("Message"), blank=True, body_field='message_body')
+    html_message = StoredBodyField(_("HTML Message"), blank=True,
+                                   body_field='html_message_body')
     """
     Emails with 'queued' status will get processed by ``send_queued`` command.
-    Status field will then be set to ``failed`` or ``sent`` depending on
-    whether it's successfully delivered.
+    While a worker holds an email it is marked as ``sending``, status field
+    will then be set to ``failed`` or ``sent`` depending on whether it's
+    successfully delivered.
     """
     status = models.PositiveSmallIntegerField(
         _("Status"),
@@ -67,15 +78,55 @@ class Email(models.Model):
     context = context_field_class(_('Context'), blank=True, null=True)
     backend_alias = models.CharField(_('Backend alias'), blank=True, default='',
                                      max_length=64)
+    claimed_by = models.CharField(_('Claimed by'), blank=True, default='',
+                                  max_length=255, editable=False)
+    claimed_at = models.DateTimeField(_('Claimed at'), blank=True, null=True,
+                                      editable=False)
+    # Transient failures are retried up to MAX_RETRIES times, the next
+    # attempt being scheduled through scheduled_time
+    number_of_retries = models.PositiveIntegerField(_('Number of retries'),
+                                                    default=0, editable=False)
+    # Large bodies are moved here when BODY_STORE is enabled
+    message_body = models.ForeignKey('post_office.EmailBody', blank=True, null=True,
+                                     related_name='+', editable=False,
+                                     on_delete=models.PROTECT)
+    html_message_body = models.ForeignKey('post_office.EmailBody', blank=True,
+                                          null=True, related_name='+',
+                                          editable=False, on_delete=models.PROTECT)
+
+    # Columns written while delivering an email, saving only these doesn't
+    # require the email to be validated again
+    BOOKKEEPING_FIELDS = frozenset(['status', 'claimed_by', 'claimed_at',
+                                    'last_updated'])
 
     class Meta:
         app_label = 'post_office'
+        # Serves get_queued(), migration 0013 makes it a partial index on
+        # PostgreSQL
+        index_together = [('status', 'priority', 'scheduled_time')]
         verbose_name = pgettext_lazy("Email address", "Email")
         verbose_name_plural = pgettext_lazy("Email addresses", "Emails")
 
     def __init__(self, *args, **kwargs):
         super(Email, self).__init__(*args, **kwargs)
         self._cached_email_message = None
+        self._validated_values = {}
+        # Duration of the stages of sending, see post_office.instrumentation
+        self.timings = {}
+
+    def mark_validated(self, *field_names):
+        """
+        Marks fields whose values have already been validated, e.g. addresses
+        checked by ``parse_emails()``, so that ``save()`` doesn't run their
+        validators again while they keep these values.
+        """
+        for field_name in field_names:
+            # Copied so that lists changed in place are validated again
+            self._validated_values[field_name] = copy(getattr(self, field_name))
+
+    def get_validated_fields(self):
+        return [field_name for field_name, value in self._validated_values.items()
+                if getattr(self, field_name) == value]
 
     def __str__(self):
         return u'%s' % self.to
@@ -89,25 +140,30 @@ class Email(models.Model):
 
         return self.prepare_email_message()
 
-    def prepare_email_message(self):
+    def prepare_email_message(self, attachment_cache=None, connection=None):
         """
         Returns a django ``EmailMessage`` or ``EmailMultiAlternatives`` object,
-        depending on whether html_message is empty.
+        depending on whether html_message is empty. Attachment payloads are
+        read through ``attachment_cache`` if given. The message is sent through
+        ``connection``, defaulting to this thread's connection to the email's
+        backend.
         """
         subject = smart_text(self.subject)
 
         if self.template is not None and self.context is not None:
-            _context = Context(self.context)
-            subject = Template(self.template.subject).render(_context)
-            message = Template(self.template.content).render(_context)
-            html_message = Template(self.template.html_content).render(_context)
+            with measure_email(self, 'render'):
+                _context = Context(self.context)
+                subject = cache.get_compiled_template(self.template, 'subject').render(_context)
+                message = cache.get_compiled_template(self.template, 'content').render(_context)
+                html_message = cache.get_compiled_template(self.template, 'html_content').render(_context)
 
         else:
             subject = self.subject
             message = self.message
             html_message = self.html_message
 
-        connection = connections[self.backend_alias or 'default']
+        if connection is None:
+            connection = connections[self.backend_alias or 'default']
 
         if html_message:
             msg = EmailMultiAlternatives(
@@ -121,9 +177,14 @@ class Email(models.Model):
                 to=self.to, bcc=self.bcc, cc=self.cc,
                 headers=self.headers, connection=connection)
 
-        for attachment in self.attachments.all():
-            msg.attach(attachment.name, attachment.file.read(), mimetype=attachment.mimetype or None)
-            attachment.file.close()
+        with measure_email(self, 'attachments'):
+            for attachment in self.attachments.all():
+                if attachment_cache is not None:
+                    content = attachment_cache.get(attachment)
+                else:
+                    content = attachment.file.read()
+                    attachment.file.close()
+                msg.attach(attachment.name, content, mimetype=attachment.mimetype or None)
 
         self._cached_email_message = msg
         return msg
@@ -134,7 +195,8 @@ class Email(models.Model):
         Sends email and log the result.
         """
         try:
-            self.email_message().send()
+            with measure_email(self, 'send'):
+                self.email_message().send()
             status = STATUS.sent
             message = ''
             exception_type = ''
@@ -152,6 +214,12 @@ class Email(models.Model):
             self.status = status
             self.save(update_fields=['status'])
 
+            if status == STATUS.sent:
+                count_emails('emails_sent', [self])
+                observe_delivery([self])
+            else:
+                count_emails('emails_failed', [self])
+
             if log_level is None:
                 log_level = get_log_level()
 
@@ -168,7 +236,16 @@ class Email(models.Model):
         return status
 
     def save(self, *args, **kwargs):
-        self.full_clean()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Saving a body may store it and point to it from its body field
+            update_fields = set(update_fields)
+            update_fields.update(field.body_field for field in self._meta.concrete_fields
+                                 if getattr(field, 'body_field', None) and
+                                 (field.name in update_fields or field.attname in update_fields))
+            kwargs['update_fields'] = update_fields
+        if update_fields is None or not self.BOOKKEEPING_FIELDS.issuperset(update_fields):
+            self.full_clean(exclude=self.get_validated_fields())
         return super(Email, self).save(*args, **kwargs)
 
 
@@ -241,6 +318,7 @@ class EmailTemplate(models.Model):
 
         template = super(EmailTemplate, self).save(*args, **kwargs)
         cache.delete(self.name)
+        cache.compiled_templates.invalidate(self.pk)
         return template
 
 
@@ -272,6 +350,12 @@ class Attachment(AttachmentMixin):
     """
     emails = models.ManyToManyField(Email, related_name='attachments',
                                     verbose_name=_('Email addresses'))
+    hash = models.CharField(_('Hash'), max_length=64, blank=True, default='',
+                            db_index=True, editable=False,
+                            help_text=_("SHA-256 of the file content"))
+    last_used = models.DateTimeField(_('Last used'), default=now, db_index=True,
+                                     editable=False,
+                                     help_text=_("When the attachment was created or last reused"))
 
     class Meta:
         app_label = 'post_office'
@@ -292,4 +376,116 @@ class AttachmentTemplate(AttachmentMixin):
         verbose_name_plural = _('Attachments Template')
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+@python_2_unicode_compatible
+class ArchivedEmail(models.Model):
+    """
+    A sent or failed email moved out of the queue table by ``archive_mail``,
+    keeping the id it had as an ``Email``.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    from_email = models.CharField(_("Email From"), max_length=254)
+    to = CommaSeparatedEmailField(_("Email To"))
+    cc = CommaSeparatedEmailField(_("Cc"))
+    bcc = CommaSeparatedEmailField(("Bcc"))
+    subject = models.CharField(_("Subject"), max_length=989, blank=True)
+    message = StoredBodyField(_("Message"), blank=True, body_field='message_body')
+    html_message = StoredBodyField(_("HTML Message"), blank=True,
+                                   body_field='html_message_body')
+    status = models.PositiveSmallIntegerField(_("Status"),
+                                              choices=Email.STATUS_CHOICES,
+                                              db_index=True, blank=True, null=True)
+    priority = models.PositiveSmallIntegerField(_("Priority"),
+                                                choices=Email.PRIORITY_CHOICES,
+                                                blank=True, null=True)
+    created = models.DateTimeField(db_index=True)
+    last_updated = models.DateTimeField()
+    scheduled_time = models.DateTimeField(_('The scheduled sending time'),
+                                          blank=True, null=True)
+    headers = JSONField(_('Headers'), blank=True, null=True)
+    template = models.ForeignKey(EmailTemplate, blank=True, null=True,
+                                 verbose_name=_('Email template'),
+                                 related_name='archived_emails',
+                                 on_delete=models.SET_NULL)
+    context = context_field_class(_('Context'), blank=True, null=True)
+    backend_alias = models.CharField(_('Backend alias'), blank=True, default='',
+                                     max_length=64)
+    number_of_retries = models.PositiveIntegerField(_('Number of retries'),
+                                                    default=0)
+    attachments = models.ManyToManyField(Attachment, blank=True,
+                                         related_name='archived_emails',
+                                         verbose_name=_('Attachments'))
+    archived_at = models.DateTimeField(_('Archived at'), auto_now_add=True,
+                                       db_index=True)
+    message_body = models.ForeignKey('post_office.EmailBody', blank=True, null=True,
+                                     related_name='+', on_delete=models.PROTECT)
+    html_message_body = models.ForeignKey('post_office.EmailBody', blank=True,
+                                          null=True, related_name='+',
+                                          on_delete=models.PROTECT)
+
+    class Meta:
+        app_label = 'post_office'
+        verbose_name = _("Archived email")
+        verbose_name_plural = _("Archived emails")
+
+    def __str__(self):
+        return u'%s' % self.to
+
+
+@python_2_unicode_compatible
+class ArchivedLog(models.Model):
+    """
+    A ``Log`` of an archived email.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    email = models.ForeignKey(ArchivedEmail, editable=False, related_name='logs',
+                              verbose_name=_('Email address'), on_delete=models.CASCADE)
+    date = models.DateTimeField()
+    status = models.PositiveSmallIntegerField(_('Status'), choices=Log.STATUS_CHOICES)
+    exception_type = models.CharField(_('Exception type'), max_length=255, blank=True)
+    message = models.TextField(_('Message'), blank=True)
+
+    class Meta:
+        app_label = 'post_office'
+        verbose_name = _("Archived log")
+        verbose_name_plural = _("Archived logs")
+
+    def __str__(self):
+        return text_type(self.date)
+
+
+class EmailBody(models.Model):
+    """
+    A compressed message body, stored once for all the emails that have it.
+    See ``BODY_STORE``.
+    """
+    hash = models.CharField(_('Hash'), max_length=64, unique=True, editable=False)
+    compression = models.CharField(_('Compression'), max_length=8, editable=False)
+    data = models.BinaryField(_('Data'))
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used = models.DateTimeField(_('Last used'), default=now, db_index=True,
+                                     editable=False,
+                                     help_text=_("When the body was stored or last reused"))
+
+    class Meta:
+        app_label = 'post_office'
+        verbose_name = _("Email body")
+        verbose_name_plural = _("Email bodies")
+
+    def __init__(self, *args, **kwargs):
+        super(EmailBody, self).__init__(*args, **kwargs)
+        self._text = None
+
+    def cache_text(self, text):
+        self._text = text
+
+    @property
+    def text(self):
+        # Bodies shared by the emails of a batch are decompressed once
+        if self._text is None:
+            self._text = decompress(self.data, self.compression)
+        return self._text
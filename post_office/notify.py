@@ -0,0 +1,90 @@
+import select
+import time
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .logutils import setup_loghandlers
+from .settings import get_notify_channel
+
+
+logger = setup_loghandlers()
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return (get_notify_channel() is not None and
+            connections[using].vendor == 'postgresql')
+
+
+def notify(using=DEFAULT_DB_ALIAS):
+    """
+    Wakes up senders waiting on ``NOTIFY_CHANNEL``. This is a no-op on
+    databases other than PostgreSQL.
+
+    PostgreSQL delivers notifications when the surrounding transaction
+    commits and collapses duplicates, so calling this once per inserted
+    email is cheap.
+    """
+    if not is_supported(using):
+        return
+
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute('NOTIFY %s' % connection.ops.quote_name(get_notify_channel()))
+
+
+class Listener(object):
+    """
+    Blocks on ``LISTEN`` until an email is queued.
+
+    A dedicated connection is used so that notifications are not lost when
+    Django's connection is closed between batches or around forks.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.database = connections[using]
+        self.channel = get_notify_channel()
+        self._connection = None
+
+    def listen(self):
+        self._connection = self.database.get_new_connection(
+            self.database.get_connection_params())
+        self._connection.autocommit = True
+        cursor = self._connection.cursor()
+        cursor.execute('LISTEN %s' % self.database.ops.quote_name(self.channel))
+        cursor.close()
+
+    def wait(self, timeout):
+        """
+        Returns True as soon as a notification is received, or False
+        after ``timeout`` seconds.
+        """
+        try:
+            if self._connection is None:
+                self.listen()
+
+            if select.select([self._connection], [], [], timeout) == ([], [], []):
+                return False
+
+            self._connection.poll()
+        except select.error:
+            # Interrupted by a signal (Python 2), let the caller decide
+            # whether to keep waiting
+            return False
+        except (DatabaseError, self.database.Database.Error) as e:
+            # Fall back to polling, the next call reconnects
+            logger.warning('Lost connection listening on %s: %s' % (self.channel, e))
+            self.close()
+            time.sleep(timeout)
+            return False
+
+        notified = bool(self._connection.notifies)
+        del self._connection.notifies[:]
+        return notified
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
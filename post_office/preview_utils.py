@@ -5,6 +5,7 @@ import tempfile
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files import File
+from django.template import Context
 from django.template.loader import render_to_string
 from django.utils import translation
 from django.utils.encoding import force_text
@@ -12,6 +13,7 @@ from django.utils.translation import (ugettext, ugettext_lazy as _,
                                       get_language)
 
 from post_office import mail
+from .cache import get_compiled_template
 from .models import Email, EmailTemplate
 
 logger = logging.getLogger('post_office')
@@ -44,6 +46,18 @@ def render_to_temporary_file(content='', context=None):
         return "La preview non e\' disponibile"
     
 
+def render_template_preview(email_template, field, context=None):
+    """
+    Renders ``field`` of ``email_template`` using the compiled template cache
+    """
+    try:
+        template = get_compiled_template(email_template, field)
+        return template.render(Context(context or {}))
+    except Exception as ex:
+        logger.exception("Si e' verificato un errore")
+        return "La preview non e\' disponibile"
+
+
 def add_style_inline(content, tag_styles):
     for tag, style in tag_styles.iteritems():
         content = content.replace(tag.lower(), style)
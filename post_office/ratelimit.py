@@ -0,0 +1,110 @@
+import time
+from collections import namedtuple
+from email.utils import getaddresses
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+from . import cache
+from .compat import string_types
+from .settings import get_backend_rate_limits, get_domain_rate_limits
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+RateLimit = namedtuple('RateLimit', 'count period')
+
+# Used when no cache is configured, limits are then enforced per process
+_local_backend = LocMemCache('post_office_ratelimit', {})
+
+
+def parse_rate(rate):
+    """
+    Parses a rate such as ``'10/s'``, ``'500/h'`` or ``(10, 1)`` into a
+    ``RateLimit`` of ``count`` messages per ``period`` seconds.
+    """
+    if isinstance(rate, string_types):
+        try:
+            count, period = rate.split('/')
+            return RateLimit(int(count), PERIODS[period.strip().lower()[0]])
+        except (ValueError, KeyError, IndexError):
+            raise ImproperlyConfigured('Invalid rate limit %r, use the form '
+                                       '"<count>/<s|m|h|d>"' % rate)
+    count, period = rate
+    return RateLimit(int(count), int(period))
+
+
+def get_domains(email):
+    addresses = getaddresses(list(email.to) + list(email.cc) + list(email.bcc))
+    return sorted(set(address.rpartition('@')[2].lower()
+                      for name, address in addresses if '@' in address))
+
+
+def get_limits(email):
+    """
+    Returns ``(key, RateLimit)`` tuples for the limits that apply to an email:
+    the limit of its backend alias and those of its recipient domains.
+    """
+    limits = []
+    backend_limits = get_backend_rate_limits()
+    alias = email.backend_alias or 'default'
+    if alias in backend_limits:
+        limits.append(('backend:%s' % alias, parse_rate(backend_limits[alias])))
+
+    domain_limits = get_domain_rate_limits()
+    if domain_limits:
+        for domain in get_domains(email):
+            if domain in domain_limits:
+                limits.append(('domain:%s' % domain, parse_rate(domain_limits[domain])))
+    return limits
+
+
+class RateLimiter(object):
+    """
+    Counts messages sent per backend alias and recipient domain in the
+    Django cache, so that the limits are shared by all threads and, with a
+    cache such as memcached or Redis, by all processes and hosts.
+
+    Each limit allows ``count`` messages per ``period`` seconds, counted in
+    fixed windows with the cache's atomic ``add()`` and ``incr()``.
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = cache.cache_backend or _local_backend
+        self.backend = backend
+
+    def get_cache_key(self, name, limit, window):
+        return 'post_office:ratelimit:%s:%s:%s' % (name, limit.period, window)
+
+    def take(self, key, limit):
+        # Expire counters after their window has passed
+        self.backend.add(key, 0, timeout=limit.period + 1)
+        try:
+            return self.backend.incr(key) <= limit.count
+        except ValueError:
+            # The counter expired in between, start the window again
+            self.backend.add(key, 1, timeout=limit.period + 1)
+            return limit.count >= 1
+
+    def acquire(self, email):
+        """
+        Takes a token from each limit that applies to the email. Returns None
+        if it can be sent now, otherwise the number of seconds until the
+        limit that was hit resets.
+        """
+        current_time = time.time()
+        taken = []
+        for name, limit in get_limits(email):
+            window = int(current_time // limit.period)
+            key = self.get_cache_key(name, limit, window)
+            if not self.take(key, limit):
+                # Give back the tokens of the other limits
+                for taken_key in taken:
+                    try:
+                        self.backend.decr(taken_key)
+                    except ValueError:
+                        pass
+                return (window + 1) * limit.period - current_time
+            taken.append(key)
+        return None
@@ -78,10 +78,89 @@ def get_threads_per_process():
     return get_config().get('THREADS_PER_PROCESS', 5)
 
 
+def get_connection_pool_size():
+    return get_config().get('CONNECTION_POOL_SIZE', get_threads_per_process())
+
+
+def get_connection_idle_timeout():
+    return get_config().get('CONNECTION_IDLE_TIMEOUT', 60)
+
+
+def get_connection_max_messages():
+    return get_config().get('CONNECTION_MAX_MESSAGES')
+
+
+def get_sending_engine():
+    return get_config().get('SENDING_ENGINE', 'threads')
+
+
+def get_async_concurrency(alias='default'):
+    concurrency = get_config().get('ASYNC_CONCURRENCY', 100)
+    if isinstance(concurrency, dict):
+        return concurrency.get(alias, 100)
+    return concurrency
+
+
+def get_max_retries():
+    return get_config().get('MAX_RETRIES', 0)
+
+
+def get_retry_interval():
+    return get_config().get('RETRY_INTERVAL', 60)
+
+
+def get_max_retry_interval():
+    return get_config().get('MAX_RETRY_INTERVAL', 3600)
+
+
+def get_backend_rate_limits():
+    return get_config().get('BACKEND_RATE_LIMITS', {})
+
+
+def get_domain_rate_limits():
+    return get_config().get('DOMAIN_RATE_LIMITS', {})
+
+
+def get_metrics_backend():
+    return get_config().get('METRICS_BACKEND')
+
+
+def get_metrics_options():
+    return get_config().get('METRICS_OPTIONS', {})
+
+
+def get_priority_lanes():
+    return get_config().get('PRIORITY_LANES')
+
+
 def get_default_priority():
     return get_config().get('DEFAULT_PRIORITY', 'medium')
 
 
+def get_template_cache_size():
+    return get_config().get('TEMPLATE_CACHE_SIZE', 300)
+
+
+def get_attachment_cache_size():
+    return get_config().get('ATTACHMENT_CACHE_SIZE', 20 * 1024 * 1024)
+
+
+def get_attachment_cache_temp_files():
+    return get_config().get('ATTACHMENT_CACHE_TEMP_FILES', False)
+
+
+def get_body_store():
+    return get_config().get('BODY_STORE', False)
+
+
+def get_body_store_min_size():
+    return get_config().get('BODY_STORE_MIN_SIZE', 1024)
+
+
+def get_body_compression():
+    return get_config().get('BODY_COMPRESSION', 'zlib')
+
+
 def get_log_level():
     return get_config().get('LOG_LEVEL', 2)
 
@@ -90,6 +169,26 @@ def get_sending_order():
     return get_config().get('SENDING_ORDER', ['-priority'])
 
 
+def get_claim_lease():
+    return get_config().get('CLAIM_LEASE', 600)
+
+
+def get_min_polling_interval():
+    return get_config().get('MIN_POLLING_INTERVAL', 0.5)
+
+
+def get_max_polling_interval():
+    return get_config().get('MAX_POLLING_INTERVAL', 10)
+
+
+def get_status_update_interval():
+    return get_config().get('STATUS_UPDATE_INTERVAL')
+
+
+def get_notify_channel():
+    return get_config().get('NOTIFY_CHANNEL', 'post_office_email')
+
+
 CONTEXT_FIELD_CLASS = get_config().get('CONTEXT_FIELD_CLASS',
                                        'jsonfield.JSONField')
 context_field_class = import_attribute(CONTEXT_FIELD_CLASS)
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+
+# Sent by the process that sent a batch of queued emails, with ``emails``,
+# the emails of the batch that were sent or failed, leaving out those
+# deferred by rate limits, and ``timings``, a dictionary of the duration of
+# each stage of the batch in seconds. The duration of the stages of each
+# email is in its ``timings`` attribute, see ``post_office.instrumentation``.
+batch_sent = Signal()
@@ -0,0 +1,41 @@
+"""
+A local SMTP server for tests of the asyncio engine, requires aiosmtpd and
+Python 3.5+.
+"""
+import socket
+
+import aiosmtplib  # noqa, required by the engine under test
+from aiosmtpd.controller import Controller
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class SMTPServer(Controller):
+
+    def __init__(self, handler):
+        self.port = get_free_port()
+        super(SMTPServer, self).__init__(handler, hostname='127.0.0.1', port=self.port)
+
+
+class RecordingHandler(object):
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('rejected@'):
+            return '550 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return '250 Message accepted for delivery'
@@ -0,0 +1,78 @@
+from unittest import skipIf
+
+from django.conf import settings
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..mail import send_queued
+from ..models import Email, STATUS
+
+try:
+    from .smtp_server import RecordingHandler, SMTPServer
+except (ImportError, SyntaxError):
+    SMTPServer = None
+
+
+@skipIf(SMTPServer is None, 'aiosmtplib and aiosmtpd are required')
+class AsyncEngineTest(TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.server = SMTPServer(self.handler)
+        self.server.start()
+        self.port = self.server.port
+
+    def tearDown(self):
+        self.server.stop()
+
+    def create_emails(self, count, backend_alias='smtp', **kwargs):
+        return [
+            Email.objects.create(to=['to%d@example.com' % i], from_email='bob@example.com',
+                                 subject='Test', message='Message',
+                                 status=STATUS.queued, backend_alias=backend_alias,
+                                 **kwargs)
+            for i in range(count)
+        ]
+
+    def override(self, **kwargs):
+        return override_settings(
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.port,
+            POST_OFFICE=dict(settings.POST_OFFICE, SENDING_ENGINE='asyncio', **kwargs)
+        )
+
+    def test_send_queued(self):
+        self.create_emails(20)
+        with self.override():
+            self.assertEqual(send_queued(), (20, 0))
+        self.assertEqual(len(self.handler.messages), 20)
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 20)
+        self.assertEqual(self.handler.messages[0].mail_from, 'bob@example.com')
+
+    def test_concurrency_limit(self):
+        self.create_emails(10)
+        with self.override(ASYNC_CONCURRENCY={'smtp': 2}):
+            self.assertEqual(send_queued(), (10, 0))
+        # At most two connections are opened and reused for all messages
+        self.assertLessEqual(len(self.handler.peers), 2)
+
+    def test_rejected_recipient(self):
+        self.create_emails(2)
+        rejected = Email.objects.create(to=['rejected@example.com'],
+                                        from_email='bob@example.com',
+                                        status=STATUS.queued, backend_alias='smtp')
+        with self.override(ASYNC_CONCURRENCY=1):
+            self.assertEqual(send_queued(), (2, 1))
+        rejected.refresh_from_db()
+        self.assertEqual(rejected.status, STATUS.failed)
+        self.assertEqual(rejected.logs.get().exception_type, 'SMTPRecipientsRefused')
+        self.assertEqual(len(self.handler.peers), 1)
+
+    def test_non_smtp_backend(self):
+        """
+        Backends other than SMTP are called from the event loop's executor
+        """
+        self.create_emails(3, backend_alias='locmem')
+        with self.override():
+            self.assertEqual(send_queued(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
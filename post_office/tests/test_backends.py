@@ -1,5 +1,7 @@
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives, send_mail, EmailMessage
+from django.core.exceptions import ValidationError
+from django.core.mail import (EmailMultiAlternatives, EmailMessage, get_connection,
+                              send_mail, send_mass_mail)
 from django.core.mail.backends.base import BaseEmailBackend
 from django.test import TestCase
 from django.test.utils import override_settings
@@ -99,6 +101,35 @@ class BackendTest(TestCase):
         self.assertEqual(email.attachments.all()[0].name, 'attachment.txt')
         self.assertEqual(email.attachments.all()[0].file.read(), b'attachment content')
 
+    @override_settings(EMAIL_BACKEND='post_office.EmailBackend')
+    def test_send_mass_mail(self):
+        messages = [('Subject %d' % i, 'Message', 'from@example.com',
+                     ['to%d@example.com' % i]) for i in range(3)]
+        self.assertEqual(send_mass_mail(messages), 3)
+        self.assertEqual(sorted(Email.objects.values_list('subject', flat=True)),
+                         ['Subject 0', 'Subject 1', 'Subject 2'])
+        self.assertEqual(get_connection().send_messages([]), 0)
+
+    @override_settings(EMAIL_BACKEND='post_office.EmailBackend')
+    def test_send_messages_with_attachments(self):
+        messages = []
+        for i in range(2):
+            message = EmailMessage('subject', 'body', 'from@example.com',
+                                   ['to@example.com'])
+            message.attach('attachment%d.txt' % i, 'content %d' % i)
+            messages.append(message)
+        self.assertEqual(get_connection().send_messages(messages), 2)
+        for i, email in enumerate(Email.objects.order_by('id')):
+            self.assertEqual([attachment.name for attachment in email.attachments.all()],
+                             ['attachment%d.txt' % i])
+
+    @override_settings(EMAIL_BACKEND='post_office.EmailBackend')
+    def test_send_messages_is_atomic(self):
+        messages = [EmailMessage('subject', 'body', 'from@example.com', ['to@example.com']),
+                    EmailMessage('subject', 'body', 'from@example.com', ['invalid'])]
+        self.assertRaises(ValidationError, get_connection().send_messages, messages)
+        self.assertFalse(Email.objects.exists())
+
     @override_settings(
         EMAIL_BACKEND='post_office.EmailBackend',
         POST_OFFICE={
@@ -0,0 +1,35 @@
+from django.test import TestCase
+
+from ..benchmark import Scenario, SMTPStub, run_scenario
+from ..models import Attachment, Email
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run_scenario(self):
+        scenario = Scenario(count=3, recipients=2, attachment_size=100,
+                            template='complex', processes=1, threads=2,
+                            backend='locmem')
+        stages = run_scenario(scenario)
+        self.assertEqual([stage.name for stage in stages],
+                         ['send_many', 'send', 'get_queued', 'send_queued'])
+        self.assertEqual([(stage.emails, stage.failed) for stage in stages],
+                         [(3, 0)] * 4)
+        self.assertTrue(all(stage.seconds > 0 for stage in stages))
+
+        # Emails and attachments are deleted
+        self.assertFalse(Email.objects.exists())
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_smtp_stub(self):
+        smtp_stub = SMTPStub()
+        smtp_stub.start()
+        try:
+            scenario = Scenario(count=2, recipients=1, attachment_size=0,
+                                template='none', processes=1, threads=1,
+                                backend='smtp')
+            stages = run_scenario(scenario, smtp_stub)
+        finally:
+            smtp_stub.stop()
+        self.assertEqual(stages[-1].emails, 2)
+        self.assertEqual(smtp_stub.received, 2)
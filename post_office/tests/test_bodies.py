@@ -0,0 +1,120 @@
+import datetime
+
+from django.conf import settings
+from django.core import mail as django_mail
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from .. import mail
+from ..bodies import compress, decompress
+from ..models import ArchivedEmail, Email, EmailBody, STATUS
+
+
+@override_settings(POST_OFFICE=dict(settings.POST_OFFICE, BODY_STORE=True,
+                                    BODY_STORE_MIN_SIZE=100))
+class BodyStoreTest(TestCase):
+
+    def setUp(self):
+        self.html_message = '<p>%s</p>' % ('Newsletter content. ' * 500)
+
+    def send(self, recipient, **kwargs):
+        kwargs.setdefault('html_message', self.html_message)
+        return mail.send([recipient], 'from@example.com', message='Short message',
+                         backend='locmem', **kwargs)
+
+    def test_compress(self):
+        data = compress(self.html_message, 'zlib')
+        self.assertLess(len(data), len(self.html_message) / 10)
+        self.assertEqual(decompress(data, 'zlib'), self.html_message)
+
+    def test_disabled(self):
+        with override_settings(POST_OFFICE=dict(settings.POST_OFFICE, BODY_STORE=False)):
+            email = self.send('to@example.com')
+        self.assertEqual(EmailBody.objects.count(), 0)
+        self.assertEqual(Email.objects.values_list('html_message', flat=True).get(id=email.id),
+                         self.html_message)
+
+    def test_store(self):
+        """
+        Large bodies are stored once, short ones stay in the email's row
+        """
+        first = self.send('first@example.com')
+        second = self.send('second@example.com')
+        body = EmailBody.objects.get()
+        self.assertEqual(body.text, self.html_message)
+        self.assertEqual(Email.objects.filter(html_message_body=body).count(), 2)
+        self.assertEqual(set(Email.objects.values_list('html_message', 'message')),
+                         set([('', 'Short message')]))
+
+        for email in (first, second):
+            email = Email.objects.get(id=email.id)
+            self.assertEqual(email.html_message, self.html_message)
+            self.assertEqual(email.message, 'Short message')
+
+        # Replacing the text replaces the body
+        first.html_message = '<p>Short</p>'
+        first.save()
+        first = Email.objects.get(id=first.id)
+        self.assertIsNone(first.html_message_body)
+        self.assertEqual(first.html_message, '<p>Short</p>')
+
+    def test_save_update_fields(self):
+        email = self.send('to@example.com', html_message='<p>Short</p>')
+        email.html_message = self.html_message
+        email.save(update_fields=['html_message'])
+        email = Email.objects.get(id=email.id)
+        self.assertEqual(email.html_message_body, EmailBody.objects.get())
+        self.assertEqual(email.html_message, self.html_message)
+
+        # Replacing a stored body clears the reference
+        email.html_message = '<p>Short</p>'
+        email.save(update_fields=['html_message'])
+        email = Email.objects.get(id=email.id)
+        self.assertIsNone(email.html_message_body)
+        self.assertEqual(email.html_message, '<p>Short</p>')
+
+    def test_send_many(self):
+        mail.send_many([{'recipients': ['to%d@example.com' % i], 'sender': 'from@example.com',
+                         'html_message': self.html_message, 'backend': 'locmem'}
+                        for i in range(3)])
+        self.assertEqual(EmailBody.objects.count(), 1)
+        self.assertEqual(Email.objects.filter(html_message_body__isnull=False).count(), 3)
+
+        mail.send_queued()
+        self.assertEqual(len(django_mail.outbox), 3)
+        self.assertEqual(django_mail.outbox[0].alternatives,
+                         [(self.html_message, 'text/html')])
+
+    def test_archive_and_cleanup(self):
+        old = self.send('old@example.com')
+        self.send('new@example.com')
+        other = self.send('other@example.com',
+                          html_message='<p>%s</p>' % ('Other content. ' * 500))
+        Email.objects.update(status=STATUS.sent)
+        Email.objects.filter(id__in=[old.id, other.id]) \
+            .update(created=now() - datetime.timedelta(31),
+                    last_updated=now() - datetime.timedelta(31))
+
+        call_command('archive_mail', days=30)
+        self.assertEqual(ArchivedEmail.objects.get(id=old.id).html_message,
+                         self.html_message)
+
+        # Recently stored bodies may be reused by emails being created
+        call_command('cleanup_mail', days=30)
+        self.assertEqual(ArchivedEmail.objects.count(), 0)
+        self.assertEqual(EmailBody.objects.count(), 2)
+
+        # The body of the old mail is still used by the new one
+        EmailBody.objects.update(last_used=now() - datetime.timedelta(1))
+        call_command('cleanup_mail', days=30)
+        self.assertEqual([body.text for body in EmailBody.objects.all()],
+                         [self.html_message])
+
+    def test_reuse_protects_body(self):
+        last_used = now() - datetime.timedelta(1)
+        self.send('first@example.com')
+        EmailBody.objects.update(last_used=last_used)
+        self.send('second@example.com')
+        self.assertGreater(EmailBody.objects.get().last_used, last_used)
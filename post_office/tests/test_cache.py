@@ -1,7 +1,11 @@
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.template import Context
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from post_office import cache
+from ..models import Attachment, EmailTemplate
 from ..settings import get_cache_backend
 
 
@@ -39,3 +43,63 @@ class CacheTest(TestCase):
         self.assertTrue('awesome content', cache.get('test-cache'))
         cache.delete('test-cache')
         self.assertEqual(None, cache.get('test-cache'))
+
+    def test_compiled_template_cache(self):
+        """
+            Compiled templates are reused until the EmailTemplate is saved
+        """
+        cache.compiled_templates.clear()
+        template = EmailTemplate.objects.create(subject='Hi {{ name }}')
+        compiled = cache.get_compiled_template(template, 'subject')
+        self.assertIs(compiled, cache.get_compiled_template(template, 'subject'))
+
+        template.subject = 'Hello {{ name }}'
+        template.save()
+        compiled = cache.get_compiled_template(template, 'subject')
+        self.assertEqual(compiled.render(Context({'name': 'Bob'})), 'Hello Bob')
+        self.assertIs(compiled, cache.get_compiled_template(template, 'subject'))
+
+    @override_settings(POST_OFFICE={'TEMPLATE_CACHE_SIZE': 2})
+    def test_compiled_template_cache_size(self):
+        cache.compiled_templates.clear()
+        template = EmailTemplate.objects.create(subject='Subject', content='Content',
+                                                html_content='HTML')
+        subject = cache.get_compiled_template(template, 'subject')
+        cache.get_compiled_template(template, 'content')
+        cache.get_compiled_template(template, 'html_content')
+        self.assertIsNot(subject, cache.get_compiled_template(template, 'subject'))
+
+    def test_attachment_cache(self):
+        """
+            Attachment payloads are read once and served from memory
+        """
+        attachment = Attachment()
+        attachment.file.save('test.txt', content=ContentFile('content'), save=True)
+        attachment_cache = cache.AttachmentCache(max_size=100)
+        self.assertEqual(attachment_cache.get(attachment), b'content')
+        self.assertEqual(attachment_cache.size, 7)
+
+        # Attachments sharing the file are served from the cache
+        attachment.file.storage.delete(attachment.file.name)
+        shared = Attachment.objects.create(file=attachment.file.name, name='shared.txt')
+        self.assertEqual(attachment_cache.get(shared), b'content')
+        attachment_cache.close()
+        self.assertEqual(attachment_cache.size, 0)
+
+    def test_attachment_cache_temp_files(self):
+        """
+            Payloads above the memory limit are kept in temporary files
+        """
+        attachment = Attachment()
+        attachment.file.save('test.txt', content=ContentFile('content'), save=True)
+
+        attachment_cache = cache.AttachmentCache(max_size=5, use_temp_files=False)
+        self.assertEqual(attachment_cache.get(attachment), b'content')
+        self.assertEqual(attachment_cache.size, 0)
+
+        attachment_cache = cache.AttachmentCache(max_size=5, use_temp_files=True)
+        self.assertEqual(attachment_cache.get(attachment), b'content')
+        attachment.file.storage.delete(attachment.file.name)
+        self.assertEqual(attachment_cache.get(attachment), b'content')
+        self.assertEqual(attachment_cache.size, 0)
+        attachment_cache.close()
@@ -1,11 +1,18 @@
 import datetime
+import os
+import pstats
+import shutil
+import tempfile
 
+from django.core.files.base import ContentFile
 from django.core.management import call_command
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils.timezone import now
 
-from ..models import Email, STATUS
+from ..archive import archive_batch
+from ..instrumentation import profiled
+from ..models import ArchivedEmail, Attachment, Email, Log, PRIORITY, STATUS
 
 
 class CommandTest(TestCase):
@@ -29,6 +36,137 @@ class CommandTest(TestCase):
         call_command('cleanup_mail', days=30)
         self.assertEqual(Email.objects.count(), 0)
 
+    def test_cleanup_mail_in_batches(self):
+        """
+        ``cleanup_mail`` never deletes queued mails and can be limited to
+        some statuses
+        """
+        old = now() - datetime.timedelta(31)
+        for status in [STATUS.sent, STATUS.sent, STATUS.failed, STATUS.queued, STATUS.sending]:
+            email = Email.objects.create(from_email='from@example.com',
+                                         to=['to@example.com'], status=status)
+            email.logs.create(status=STATUS.sent)
+        Email.objects.update(created=old)
+
+        call_command('cleanup_mail', days=30, batch_size=1, status=['sent'])
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 0)
+        self.assertEqual(Email.objects.count(), 3)
+        self.assertEqual(Log.objects.count(), 3)
+
+        call_command('cleanup_mail', days=30)
+        self.assertEqual(set(Email.objects.values_list('status', flat=True)),
+                         set([STATUS.queued, STATUS.sending]))
+
+    def test_cleanup_mail_attachments(self):
+        """
+        ``cleanup_mail --delete-attachments`` deletes attachments only used
+        by the deleted mails, and their files unless shared
+        """
+        old_email = Email.objects.create(from_email='from@example.com',
+                                         to=['to@example.com'], status=STATUS.sent)
+        Email.objects.filter(id=old_email.id).update(created=now() - datetime.timedelta(31))
+        new_email = Email.objects.create(from_email='from@example.com',
+                                         to=['to@example.com'], status=STATUS.sent)
+
+        orphan = Attachment(name='orphan.txt')
+        orphan.file.save('orphan.txt', content=ContentFile('orphan'), save=True)
+        orphan.emails.add(old_email)
+        # Shares its file with an attachment that is still used
+        shared = Attachment(name='shared.txt')
+        shared.file.save('shared.txt', content=ContentFile('shared'), save=True)
+        shared.emails.add(old_email)
+        Attachment.objects.create(name='shared.txt', file=shared.file.name) \
+            .emails.add(new_email)
+        used = Attachment(name='used.txt')
+        used.file.save('used.txt', content=ContentFile('used'), save=True)
+        used.emails.add(old_email, new_email)
+        Attachment.objects.update(last_used=now() - datetime.timedelta(31))
+
+        storage = orphan.file.storage
+        call_command('cleanup_mail', days=30, delete_attachments=True)
+        self.assertEqual(Attachment.objects.count(), 2)
+        self.assertFalse(Attachment.objects.filter(id__in=[orphan.id, shared.id]).exists())
+        self.assertFalse(storage.exists(orphan.file.name))
+        self.assertTrue(storage.exists(shared.file.name))
+        self.assertTrue(storage.exists(used.file.name))
+
+    def test_cleanup_attachments(self):
+        """
+        ``cleanup_attachments`` deletes attachments without mails and files
+        without attachments
+        """
+        email = Email.objects.create(from_email='from@example.com',
+                                     to=['to@example.com'], status=STATUS.sent)
+        used = Attachment(name='used.txt')
+        used.file.save('used.txt', content=ContentFile('used'), save=True)
+        used.emails.add(email)
+        orphan = Attachment(name='orphan.txt')
+        orphan.file.save('orphan.txt', content=ContentFile('orphan'), save=True)
+        storage = used.file.storage
+        stray = storage.save('post_office_attachments/stray.txt', ContentFile('stray'))
+
+        call_command('cleanup_attachments', dry_run=True, min_age=0)
+        self.assertEqual(Attachment.objects.count(), 2)
+        self.assertTrue(storage.exists(stray))
+
+        # Recently created attachments and modified files are kept
+        call_command('cleanup_attachments')
+        self.assertEqual(Attachment.objects.count(), 2)
+        self.assertTrue(storage.exists(stray))
+
+        call_command('cleanup_attachments', min_age=0)
+        self.assertEqual(list(Attachment.objects.all()), [used])
+        self.assertFalse(storage.exists(orphan.file.name))
+        self.assertFalse(storage.exists(stray))
+        self.assertTrue(storage.exists(used.file.name))
+
+    def test_archive_mail(self):
+        """
+        The ``archive_mail`` command moves old sent and failed mails, with
+        their logs and attachments, to the archive tables
+        """
+        old = now() - datetime.timedelta(31)
+        sent = Email.objects.create(from_email='from@example.com',
+                                    to=['to@example.com'], status=STATUS.sent,
+                                    subject='Sent', headers={'Reply-To': 'me@example.com'})
+        sent.logs.create(status=STATUS.sent)
+        attachment = Attachment(name='test.txt')
+        attachment.file.save('test.txt', content=ContentFile('content'), save=True)
+        attachment.emails.add(sent)
+        queued = Email.objects.create(from_email='from@example.com',
+                                      to=['to@example.com'], status=STATUS.queued)
+        recent = Email.objects.create(from_email='from@example.com',
+                                      to=['to@example.com'], status=STATUS.failed)
+        Email.objects.filter(id__in=[sent.id, queued.id]).update(last_updated=old)
+
+        call_command('archive_mail', days=30, batch_size=1)
+        self.assertEqual(list(Email.objects.order_by('id')), [queued, recent])
+        self.assertEqual(Log.objects.count(), 0)
+
+        archived = ArchivedEmail.objects.get()
+        self.assertEqual(archived.id, sent.id)
+        self.assertEqual(archived.subject, 'Sent')
+        self.assertEqual(archived.to, ['to@example.com'])
+        self.assertEqual(archived.headers, {'Reply-To': 'me@example.com'})
+        self.assertEqual(archived.status, STATUS.sent)
+        self.assertEqual(archived.logs.get().status, STATUS.sent)
+        self.assertEqual(list(archived.attachments.all()), [attachment])
+        self.assertEqual(list(attachment.emails.all()), [])
+
+    def test_archive_batch_skips_requeued(self):
+        """
+        Emails requeued after being listed for archiving stay in the queue
+        """
+        before = now() - datetime.timedelta(30)
+        email = Email.objects.create(from_email='from@example.com',
+                                     to=['to@example.com'], status=STATUS.queued)
+        email.logs.create(status=STATUS.failed)
+        Email.objects.filter(id=email.id).update(last_updated=before - datetime.timedelta(1))
+        self.assertEqual(archive_batch([email.id], before), 0)
+        self.assertEqual(list(Email.objects.all()), [email])
+        self.assertEqual(email.logs.count(), 1)
+        self.assertEqual(ArchivedEmail.objects.count(), 0)
+
     TEST_SETTINGS = {
         'BACKENDS': {
             'default': 'django.core.mail.backends.dummy.EmailBackend',
@@ -53,6 +191,39 @@ class CommandTest(TestCase):
         self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 2)
         self.assertEqual(Email.objects.filter(status=STATUS.queued).count(), 0)
 
+    @override_settings(POST_OFFICE=TEST_SETTINGS)
+    def test_send_queued_mail_with_priority(self):
+        high = Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                    status=STATUS.queued, priority=PRIORITY.high)
+        low = Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                   status=STATUS.queued, priority=PRIORITY.low)
+        call_command('send_queued_mail', processes=1, priority=['high', 'now'])
+        self.assertEqual(Email.objects.get(id=high.id).status, STATUS.sent)
+        self.assertEqual(Email.objects.get(id=low.id).status, STATUS.queued)
+
+    def test_send_queued_mail_with_profile(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Nothing is written when the queue is empty
+        call_command('send_queued_mail', profile=directory)
+        self.assertEqual(os.listdir(directory), [])
+
+        Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                             status=STATUS.queued)
+        call_command('send_queued_mail', profile=directory)
+        filename, = os.listdir(directory)
+        stats = pstats.Stats(os.path.join(directory, filename))
+        self.assertTrue(any(function[2] == '_send_bulk' for function in stats.stats))
+
+    def test_discarded_profile_raises(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.assertRaises(RuntimeError):
+            with profiled(directory) as discard_profile:
+                discard_profile()
+                raise RuntimeError('Batch failed')
+        self.assertEqual(os.listdir(directory), [])
+
     def test_successful_deliveries_logging(self):
         """
         Successful deliveries are only logged when log_level is 2.
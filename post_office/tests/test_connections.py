@@ -1,13 +1,95 @@
-from django.core.mail import backends
+from smtplib import SMTPDataError, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, backends
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from .test_backends import ErrorRaisingBackend
-from ..connections import connections
+from ..connections import ConnectionPool, connections
+
+
+class CountingBackend(LocmemBackend):
+    """
+    A locmem backend that counts how many connections are opened and how
+    many times it sends, optionally failing with ``error_once`` on its first
+    message
+    """
+    opened = 0
+    sends = 0
+    error_once = None
+
+    def open(self):
+        CountingBackend.opened += 1
+
+    def send_messages(self, messages):
+        CountingBackend.sends += 1
+        if CountingBackend.error_once is not None:
+            error, CountingBackend.error_once = CountingBackend.error_once, None
+            raise error
+        return super(CountingBackend, self).send_messages(messages)
+
+
+def get_message(connection):
+    return EmailMessage(subject='Test', to=['to@example.com'],
+                        from_email='from@example.com', connection=connection)
 
 
 class ConnectionTest(TestCase):
 
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.sends = 0
+        CountingBackend.error_once = None
+        self.pool = ConnectionPool('post_office.tests.test_connections.CountingBackend',
+                                   max_size=2)
+
     def test_get_connection(self):
         # Ensure ConnectionHandler returns the right connection
         self.assertTrue(isinstance(connections['error'], ErrorRaisingBackend))
         self.assertTrue(isinstance(connections['locmem'], backends.locmem.EmailBackend))
+
+    def test_get_pool(self):
+        pool = connections.get_pool('locmem')
+        self.assertIs(pool, connections.get_pool('locmem'))
+        self.assertRaises(KeyError, connections.get_pool, 'random')
+
+        # Closing connections also discards the pools
+        connections.close()
+        self.assertIsNot(pool, connections.get_pool('locmem'))
+
+    def test_pool_reuses_connections(self):
+        for i in range(3):
+            self.assertEqual(get_message(self.pool).send(), 1)
+        self.assertEqual(CountingBackend.opened, 1)
+
+        # Checked out connections aren't shared
+        connection = self.pool.acquire()
+        self.assertIsNot(self.pool.acquire(), connection)
+        self.assertEqual(CountingBackend.opened, 2)
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, CONNECTION_MAX_MESSAGES=2))
+    def test_pool_max_messages(self):
+        for i in range(5):
+            get_message(self.pool).send()
+        self.assertEqual(CountingBackend.opened, 3)
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, CONNECTION_IDLE_TIMEOUT=0))
+    def test_pool_idle_timeout(self):
+        get_message(self.pool).send()
+        get_message(self.pool).send()
+        self.assertEqual(CountingBackend.opened, 2)
+
+    def test_pool_reconnects_when_disconnected(self):
+        get_message(self.pool).send()
+        CountingBackend.error_once = SMTPServerDisconnected('Connection unexpectedly closed')
+        self.assertEqual(get_message(self.pool).send(), 1)
+        self.assertEqual(CountingBackend.opened, 2)
+
+    def test_pool_keeps_connection_on_rejected_message(self):
+        get_message(self.pool).send()
+        CountingBackend.error_once = SMTPDataError(554, 'Message rejected')
+        self.assertRaises(SMTPDataError, get_message(self.pool).send)
+        self.assertEqual(CountingBackend.sends, 2)
+        self.assertEqual(CountingBackend.opened, 1)
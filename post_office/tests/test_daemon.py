@@ -0,0 +1,131 @@
+import os
+import signal
+import threading
+
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+
+from ..daemon import Daemon, run_lanes
+from ..models import Email, PRIORITY, STATUS
+from ..signals import batch_sent
+
+
+class DaemonTest(TestCase):
+
+    def setUp(self):
+        self.intervals = []
+
+    def get_daemon(self, max_waits=1):
+        daemon = Daemon()
+        daemon.install_signal_handlers = lambda: None
+
+        def wait(timeout):
+            self.intervals.append(timeout)
+            if len(self.intervals) >= max_waits:
+                daemon.stop()
+        daemon.wait = wait
+        return daemon
+
+    @override_settings(POST_OFFICE={'BATCH_SIZE': 2})
+    def test_run_sends_queued_emails(self):
+        """
+        The daemon keeps fetching batches without waiting while the queue
+        is full and only waits once a batch comes back partially filled.
+        """
+        for i in range(5):
+            Email.objects.create(from_email='from@example.com',
+                                 to=['to@example.com'], status=STATUS.queued)
+        self.get_daemon().run()
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 5)
+        self.assertEqual(self.intervals, [0.5])
+
+    def test_run_with_priorities(self):
+        """
+        A daemon dedicated to some priorities leaves other emails queued
+        """
+        high = Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                    status=STATUS.queued, priority=PRIORITY.high)
+        low = Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                   status=STATUS.queued, priority=PRIORITY.low)
+        daemon = self.get_daemon()
+        daemon.priorities = [PRIORITY.high, PRIORITY.now]
+        daemon.run()
+        self.assertEqual(Email.objects.get(id=high.id).status, STATUS.sent)
+        self.assertEqual(Email.objects.get(id=low.id).status, STATUS.queued)
+
+    @override_settings(POST_OFFICE={'MIN_POLLING_INTERVAL': 1,
+                                    'MAX_POLLING_INTERVAL': 5})
+    def test_polling_interval_backs_off_when_idle(self):
+        self.get_daemon(max_waits=5).run()
+        self.assertEqual(self.intervals, [1, 2, 4, 5, 5])
+
+    def test_sigterm_stops_daemon(self):
+        daemon = Daemon()
+        previous_handlers = (signal.getsignal(signal.SIGTERM),
+                             signal.getsignal(signal.SIGINT))
+        try:
+            daemon.install_signal_handlers()
+            self.assertFalse(daemon.stopped)
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertTrue(daemon.stopped)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handlers[0])
+            signal.signal(signal.SIGINT, previous_handlers[1])
+
+
+@override_settings(POST_OFFICE=dict(settings.POST_OFFICE, DEFAULT_PRIORITY='medium',
+                                    MIN_POLLING_INTERVAL=0.1))
+class LanesTest(TransactionTestCase):
+    """
+    Lanes run in threads, which only see committed emails
+    """
+    lanes = [{'priorities': ['high']}, {'priorities': ['medium', 'low']}]
+
+    def setUp(self):
+        # The test database doesn't handle concurrent writes, batches of
+        # the lanes are sent one at a time
+        lock = threading.Lock()
+        send_batch = Daemon.send_batch
+
+        def send_batch_with_lock(daemon):
+            with lock:
+                return send_batch(daemon)
+        Daemon.send_batch = send_batch_with_lock
+        self.addCleanup(setattr, Daemon, 'send_batch', send_batch)
+
+        previous_handlers = (signal.getsignal(signal.SIGTERM),
+                             signal.getsignal(signal.SIGINT))
+        self.addCleanup(signal.signal, signal.SIGTERM, previous_handlers[0])
+        self.addCleanup(signal.signal, signal.SIGINT, previous_handlers[1])
+        for priority in [PRIORITY.high, PRIORITY.medium, PRIORITY.low]:
+            Email.objects.create(from_email='from@example.com', to=['to@example.com'],
+                                 priority=priority, status=STATUS.queued,
+                                 backend_alias='locmem')
+
+    def connect(self, receiver):
+        batch_sent.connect(receiver)
+        self.addCleanup(batch_sent.disconnect, receiver)
+
+    def test_run_lanes(self):
+        stop_event = threading.Event()
+        batches = []
+
+        def receiver(sender, emails, **kwargs):
+            batches.append(set(email.priority for email in emails))
+            if not Email.objects.filter(status=STATUS.queued).exists():
+                stop_event.set()
+        self.connect(receiver)
+
+        run_lanes(self.lanes, stop_event=stop_event)
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 3)
+        self.assertIn(set([PRIORITY.high]), batches)
+        self.assertIn(set([PRIORITY.medium, PRIORITY.low]), batches)
+
+    def test_failing_lane_stops_lanes(self):
+        def receiver(sender, emails, **kwargs):
+            if any(email.priority == PRIORITY.high for email in emails):
+                raise ValueError('Lane failed')
+        self.connect(receiver)
+
+        self.assertRaises(ValueError, run_lanes, self.lanes)
@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from smtplib import SMTPServerDisconnected
 
 from django.core import mail
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.db import connection
 
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils.timezone import now
 
 from ..settings import get_batch_size, get_log_level, get_threads_per_process
-from ..models import Email, EmailTemplate, Attachment, PRIORITY, STATUS
-from ..mail import (create, get_queued,
-                    send, send_many, send_queued, _send_bulk)
+from ..models import (Email, EmailTemplate, Attachment, HEAVY_FIELDS, Log,
+                      PRIORITY, STATUS)
+from ..mail import (create, create_process_pool, get_queued, load_heavy_fields,
+                    send, send_many, send_queued, send_stream, _send_bulk)
+from ..signals import batch_sent
 
 
 connection_counter = 0
@@ -31,6 +36,15 @@ class ConnectionTestingBackend(mail.backends.base.BaseEmailBackend):
         pass
 
 
+class TransientErrorBackend(mail.backends.base.BaseEmailBackend):
+    '''
+    An EmailBackend that fails as if the SMTP server was unavailable
+    '''
+
+    def send_messages(self, email_messages):
+        raise SMTPServerDisconnected('Connection unexpectedly closed')
+
+
 class MailTest(TestCase):
 
     @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
@@ -74,6 +88,22 @@ class MailTest(TestCase):
         total_sent, total_failed = send_queued(processes=2)
         self.assertEqual(total_sent, 3)
 
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, THREADS_PER_PROCESS=1))
+    def test_send_queued_mail_with_process_pool(self):
+        """
+        A process pool can be reused across batches, its processes fetch the
+        emails from the ids they are given
+        """
+        for i in range(5):
+            Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                 status=STATUS.queued)
+        pool = create_process_pool(2)
+        try:
+            self.assertEqual(send_queued(processes=2, pool=pool), (5, 0))
+            self.assertEqual(send_queued(processes=2, pool=pool), (0, 0))
+        finally:
+            pool.terminate()
+
     def test_send_bulk(self):
         """
         Ensure _send_bulk() properly sends out emails.
@@ -87,7 +117,38 @@ class MailTest(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'send bulk')
 
-    @override_settings(EMAIL_BACKEND='post_office.tests.test_mail.ConnectionTestingBackend')
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, STATUS_UPDATE_INTERVAL=2))
+    def test_send_bulk_incremental_status_updates(self):
+        """
+        With STATUS_UPDATE_INTERVAL, _send_bulk() writes statuses and logs
+        every few messages and still reports the totals of the batch.
+        """
+        emails = [
+            Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                 status=STATUS.sending, backend_alias=backend_alias)
+            for backend_alias in ['locmem', 'locmem', 'error', 'locmem', 'locmem']
+        ]
+        self.assertEqual(_send_bulk(emails, uses_multiprocessing=False), (4, 1))
+        self.assertEqual(Email.objects.filter(status=STATUS.sent).count(), 4)
+        self.assertEqual(Email.objects.filter(status=STATUS.failed).count(), 1)
+        self.assertEqual(Log.objects.count(), 5)
+
+    def test_send_bulk_doesnt_send_unprepared_emails(self):
+        """
+        Emails whose message can't be prepared are marked as failed once
+        and never handed to the backend.
+        """
+        template = EmailTemplate.objects.create(subject='{% if foo %}Subject')
+        email = Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                     template=template, context={'foo': 'bar'},
+                                     status=STATUS.sending, backend_alias='locmem')
+        self.assertEqual(_send_bulk([email], uses_multiprocessing=False), (0, 1))
+        self.assertEqual(Email.objects.get(id=email.id).status, STATUS.failed)
+        self.assertEqual(email.logs.count(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(EMAIL_BACKEND='post_office.tests.test_mail.ConnectionTestingBackend',
+                       POST_OFFICE=dict(settings.POST_OFFICE, CONNECTION_POOL_SIZE=1))
     def test_send_bulk_reuses_open_connection(self):
         """
         Ensure _send_bulk() only opens connection once to send multiple emails.
@@ -129,13 +190,93 @@ class MailTest(TestCase):
 
         # Email scheduled for the future should not be included
         Email.objects.create(status=STATUS.queued,
-                             scheduled_time=date(2020, 12, 13), **kwargs)
-        self.assertEqual(list(get_queued()), [queued_email])
+                             scheduled_time=now() + timedelta(days=1), **kwargs)
+        self.assertEqual(list(get_queued()), [])
 
         # Email scheduled in the past should be included
         past_email = Email.objects.create(status=STATUS.queued,
                                           scheduled_time=date(2010, 12, 13), **kwargs)
-        self.assertEqual(list(get_queued()), [queued_email, past_email])
+        self.assertEqual(list(get_queued()), [past_email])
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, BATCH_SIZE=2))
+    def test_get_queued_sending_order(self):
+        """
+        Ensure a batch holds the first emails in sending order, whether or
+        not they are scheduled
+        """
+        kwargs = {'to': 'to@example.com', 'from_email': 'bob@example.com',
+                  'status': STATUS.queued}
+        Email.objects.create(priority=PRIORITY.low, scheduled_time=None, **kwargs)
+        high = Email.objects.create(priority=PRIORITY.high, scheduled_time=None, **kwargs)
+        Email.objects.create(priority=PRIORITY.low, scheduled_time=now(), **kwargs)
+        medium = Email.objects.create(priority=PRIORITY.medium, scheduled_time=now(),
+                                      **kwargs)
+        self.assertEqual(get_queued(), [high, medium])
+
+    def test_queue_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Email._meta.db_table)
+        # Adding columns on SQLite rebuilds the table, which must keep the index
+        self.assertIn(['status', 'priority', 'scheduled_time'],
+                      [constraint['columns'] for constraint in constraints.values()
+                       if constraint['index']])
+
+    def test_get_queued_claims_emails(self):
+        """
+        Ensure get_queued marks returned emails as sending so that they
+        are not returned again until their claim expires
+        """
+        email = Email.objects.create(to='to@example.com', from_email='bob@example.com',
+                                     status=STATUS.queued)
+        self.assertEqual(get_queued(), [email])
+
+        email = Email.objects.get(id=email.id)
+        self.assertEqual(email.status, STATUS.sending)
+        self.assertNotEqual(email.claimed_by, '')
+        self.assertIsNotNone(email.claimed_at)
+        self.assertEqual(get_queued(), [])
+
+        # Claims older than CLAIM_LEASE are reclaimed
+        Email.objects.filter(id=email.id).update(
+            claimed_at=now() - timedelta(seconds=601))
+        self.assertEqual(get_queued(), [email])
+
+        with self.settings(POST_OFFICE={'CLAIM_LEASE': 3600}):
+            Email.objects.filter(id=email.id).update(
+                claimed_at=now() - timedelta(seconds=601))
+            self.assertEqual(get_queued(), [])
+
+    def test_get_queued_defers_heavy_fields(self):
+        """
+        ``get_queued()`` doesn't load bodies, context and headers, which
+        ``load_heavy_fields()`` loads with one query for all emails
+        """
+        for recipient in ['first@example.com', 'second@example.com']:
+            send([recipient], 'from@example.com', message='Message',
+                 html_message='<p>HTML</p>', headers={'Reply-To': 'me@example.com'})
+        emails = get_queued()
+        for email in emails:
+            self.assertEqual(email.get_deferred_fields(), set(HEAVY_FIELDS))
+
+        with self.assertNumQueries(1):
+            load_heavy_fields(emails)
+            for email in emails:
+                self.assertEqual(email.message, 'Message')
+                self.assertEqual(email.html_message, '<p>HTML</p>')
+                self.assertEqual(email.headers, {'Reply-To': 'me@example.com'})
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_send_queued_mail_with_expired_claim(self):
+        """
+        Emails left in sending status by a crashed worker are sent once
+        their claim expires.
+        """
+        email = Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                     status=STATUS.sending, claimed_by='crashed',
+                                     claimed_at=now() - timedelta(seconds=601))
+        send_queued()
+        self.assertEqual(Email.objects.get(id=email.id).status, STATUS.sent)
 
     def test_get_batch_size(self):
         """
@@ -228,6 +369,37 @@ class MailTest(TestCase):
         send_many(kwargs_list)
         self.assertEqual(Email.objects.filter(to=['a@example.com']).count(), 1)
 
+    def test_send_stream(self):
+        """
+        send_stream() consumes kwargs lazily and queues every email
+        """
+        def kwargs_generator():
+            for i in range(5):
+                yield {'sender': 'from@example.com',
+                       'recipients': ['%s@example.com' % i],
+                       'subject': 'Subject {{ i }}', 'context': {'i': i}}
+
+        self.assertEqual(send_stream(kwargs_generator(), chunk_size=2), 5)
+        self.assertEqual(Email.objects.filter(status=STATUS.queued).count(), 5)
+        self.assertEqual(Email.objects.get(to=['3@example.com']).subject, 'Subject 3')
+
+    def test_send_stream_with_shared_attachments(self):
+        kwargs_list = [
+            {'sender': 'from@example.com', 'recipients': ['a@example.com']},
+            {'sender': 'from@example.com', 'recipients': ['b@example.com']},
+            {'sender': 'from@example.com', 'recipients': ['c@example.com']},
+        ]
+        attachments = {'attachment.txt': ContentFile('content')}
+        self.assertEqual(send_stream(kwargs_list, chunk_size=2,
+                                     attachments=attachments), 3)
+        attachment = Attachment.objects.get()
+        self.assertEqual(attachment.emails.count(), 3)
+
+        # Existing attachments can be shared too
+        send_stream(kwargs_list, attachments=[attachment])
+        self.assertEqual(Attachment.objects.count(), 1)
+        self.assertEqual(attachment.emails.count(), 6)
+
     def test_send_with_attachments(self):
         attachments = {
             'attachment_file1.txt': ContentFile('content'),
@@ -387,6 +559,56 @@ class MailTest(TestCase):
                      render_on_delivery=True)
         self.assertEqual(email.template.language, 'ru')
 
+    @override_settings(POST_OFFICE=dict(
+        settings.POST_OFFICE, MAX_RETRIES=1,
+        BACKENDS=dict(settings.POST_OFFICE['BACKENDS'],
+                      transient='post_office.tests.test_mail.TransientErrorBackend')))
+    def test_send_queued_retries_transient_errors(self):
+        email = Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                     status=STATUS.queued, backend_alias='transient')
+        self.assertEqual(send_queued(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, STATUS.queued)
+        self.assertEqual(email.number_of_retries, 1)
+        self.assertEqual(email.claimed_by, '')
+        self.assertGreater(email.scheduled_time, now())
+        self.assertEqual(email.logs.get().exception_type, 'SMTPServerDisconnected')
+
+        # Emails that used up their retries fail permanently
+        Email.objects.filter(id=email.id).update(scheduled_time=now())
+        self.assertEqual(send_queued(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, STATUS.failed)
+        self.assertEqual(email.number_of_retries, 1)
+
+        # Permanent errors are not retried
+        email = Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                     status=STATUS.queued, backend_alias='error')
+        send_queued()
+        email.refresh_from_db()
+        self.assertEqual(email.status, STATUS.failed)
+        self.assertEqual(email.number_of_retries, 0)
+
+    def test_batch_sent_timings(self):
+        batches = []
+
+        def receiver(sender, emails, timings, **kwargs):
+            batches.append((emails, timings))
+        batch_sent.connect(receiver)
+        self.addCleanup(batch_sent.disconnect, receiver)
+
+        template = EmailTemplate.objects.create(subject='Subject {{ name }}',
+                                                content='Content {{ name }}')
+        email = send(['to@example.com'], 'from@example.com', template=template,
+                     context={'name': 'test'}, render_on_delivery=True,
+                     attachments={'file.txt': ContentFile('content')})
+        send_queued()
+
+        emails, timings = batches[0]
+        self.assertEqual(emails, [email])
+        self.assertEqual(sorted(timings), ['fetch', 'load', 'prepare', 'send', 'update'])
+        self.assertEqual(sorted(emails[0].timings), ['attachments', 'render', 'send'])
+
     def test_send_bulk_with_faulty_template(self):
         template = EmailTemplate.objects.create(
             subject='{% if foo %}Subject {{ name }}',
@@ -0,0 +1,136 @@
+import os
+import shutil
+import socket
+import tempfile
+from unittest import skipIf
+
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import mail
+from ..metrics import Metrics, PrometheusMetrics, StatsDMetrics, get_metrics
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class RecordingMetrics(Metrics):
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+
+    def increment(self, name, value=1, labels=None):
+        self.records.append(('increment', name, value, labels))
+
+    def observe(self, name, value, labels=None):
+        self.records.append(('observe', name, value, labels))
+
+    def gauge(self, name, value, labels=None):
+        self.records.append(('gauge', name, value, labels))
+
+
+@override_settings(POST_OFFICE=dict(
+    settings.POST_OFFICE, METRICS_BACKEND='post_office.tests.test_metrics.RecordingMetrics'))
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        self.metrics = get_metrics()
+        self.metrics.records = []
+
+    def get_records(self, kind, name):
+        return [record[2:] for record in self.metrics.records
+                if record[:2] == (kind, name)]
+
+    def test_disabled_by_default(self):
+        with override_settings(POST_OFFICE={}):
+            self.assertFalse(get_metrics().enabled)
+
+    def test_send_queued(self):
+        mail.send_many([
+            {'recipients': ['to@example.com'], 'sender': 'from@example.com',
+             'priority': 'high', 'backend': 'locmem'},
+            {'recipients': ['to@example.com'], 'sender': 'from@example.com',
+             'priority': 'high', 'backend': 'locmem'},
+        ])
+        mail.send(['to@example.com'], 'from@example.com', priority='low',
+                  backend='error')
+        labels = {'backend': 'locmem', 'priority': 'high'}
+        self.assertEqual(self.get_records('increment', 'emails_enqueued'),
+                         [(2, labels), (1, {'backend': 'error', 'priority': 'low'})])
+
+        self.metrics.records = []
+        mail.send_queued()
+        self.assertIn((2, {'priority': 'high'}), self.get_records('gauge', 'queue_depth'))
+        self.assertIn((0, {'priority': 'now'}), self.get_records('gauge', 'queue_depth'))
+        self.assertEqual(self.get_records('increment', 'emails_sent'), [(2, labels)])
+        self.assertEqual(self.get_records('increment', 'emails_failed'),
+                         [(1, {'backend': 'error', 'priority': 'low'})])
+        self.assertEqual(len(self.get_records('observe', 'send_seconds')), 3)
+        self.assertEqual(len(self.get_records('observe', 'batch_fetch_seconds')), 1)
+        self.assertEqual(len(self.get_records('observe', 'batch_load_seconds')), 1)
+        latencies = self.get_records('observe', 'delivery_latency_seconds')
+        self.assertEqual([labels for (value, labels) in latencies], [labels, labels])
+        self.assertTrue(all(value >= 0 for (value, labels) in latencies))
+
+
+class StatsDMetricsTest(TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(1)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def receive(self):
+        return self.server.recv(1024).decode('utf-8')
+
+    def test_labels_in_names(self):
+        metrics = StatsDMetrics('127.0.0.1', self.port)
+        metrics.increment('emails_sent', 3, {'backend': 'default', 'priority': 'high'})
+        self.assertEqual(self.receive(), 'post_office.emails_sent.default.high:3|c')
+        metrics.observe('send_seconds', 0.25, {'backend': 'ses.eu'})
+        self.assertEqual(self.receive(), 'post_office.send_seconds.ses_eu:250|ms')
+        metrics.gauge('queue_depth', 10)
+        self.assertEqual(self.receive(), 'post_office.queue_depth:10|g')
+
+    def test_tags(self):
+        metrics = StatsDMetrics('127.0.0.1', self.port, prefix='mail', tags=True)
+        metrics.increment('emails_sent', 1, {'priority': 'high', 'backend': 'default'})
+        self.assertEqual(self.receive(),
+                         'mail.emails_sent:1|c|#backend:default,priority:high')
+
+
+@skipIf(prometheus_client is None, 'prometheus_client is not installed')
+class PrometheusMetricsTest(TestCase):
+
+    def test_metrics(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        textfile = os.path.join(directory, 'post_office.prom')
+        registry = prometheus_client.CollectorRegistry()
+        metrics = PrometheusMetrics(registry=registry, textfile=textfile)
+
+        labels = {'backend': 'default', 'priority': 'high'}
+        metrics.increment('emails_sent', 2, labels)
+        metrics.increment('emails_sent', 1, labels)
+        metrics.observe('delivery_latency_seconds', 20, labels)
+        metrics.gauge('queue_depth', 5, {'priority': 'low'})
+        self.assertEqual(
+            registry.get_sample_value('post_office_emails_sent_total', labels), 3)
+        self.assertEqual(
+            registry.get_sample_value('post_office_delivery_latency_seconds_bucket',
+                                      dict(labels, le='30.0')), 1)
+        self.assertEqual(
+            registry.get_sample_value('post_office_queue_depth', {'priority': 'low'}), 5)
+
+        metrics.flush()
+        with open(textfile) as f:
+            self.assertIn('post_office_emails_sent_total{backend="default",priority="high"} 3.0',
+                          f.read())
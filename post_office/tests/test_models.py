@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 
 from django.conf import settings as django_settings
 from django.core import mail
+from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.forms.models import modelform_factory
@@ -137,6 +138,33 @@ class ModelTest(TestCase):
         self.assertRaises(ValueError, send, bcc='bcc@example.com', sender='from@a.com',
                           template='foo', html_message='bar')
 
+    def test_send_invalid_sender(self):
+        self.assertRaises(ValidationError, send, ['to@example.com'], 'invalid')
+
+    def test_save_skips_validation_of_bookkeeping_fields(self):
+        """
+        Saving only bookkeeping columns, or fields marked as validated,
+        doesn't run the field validators again.
+        """
+        email = Email.objects.create(to=['to@example.com'], from_email='from@example.com')
+        email.to = ['invalid']
+        email.status = STATUS.sent
+        email.save(update_fields=['status'])
+        self.assertRaises(ValidationError, email.save)
+        self.assertRaises(ValidationError, email.save, update_fields=['status', 'to'])
+
+        email.mark_validated('to')
+        email.save()
+        self.assertEqual(Email.objects.get(id=email.id).to, ['invalid'])
+
+        # Fields changed after being marked as validated are validated again
+        email = send(['to@example.com'], 'from@example.com')
+        email.cc = ['invalid']
+        self.assertRaises(ValidationError, email.save)
+        email.cc = []
+        email.to.append('invalid')
+        self.assertRaises(ValidationError, email.save)
+
     def test_send_with_template(self):
         """
         Ensure mail.send correctly creates templated emails to recipients
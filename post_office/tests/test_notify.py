@@ -0,0 +1,25 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..daemon import Daemon
+from ..notify import is_supported, notify
+
+
+class NotifyTest(TestCase):
+
+    def test_is_supported(self):
+        self.assertEqual(is_supported(), connection.vendor == 'postgresql')
+
+        with override_settings(POST_OFFICE={'NOTIFY_CHANNEL': None}):
+            self.assertFalse(is_supported())
+
+    def test_notify_without_listen_support(self):
+        """
+        Other databases fall back to polling: notify() does nothing and
+        the daemon doesn't set up a listener.
+        """
+        if is_supported():
+            self.skipTest('Database supports LISTEN/NOTIFY')
+        notify()
+        self.assertIsNone(Daemon().listener)
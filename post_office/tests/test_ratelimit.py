@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from ..mail import send_queued
+from ..models import Email, STATUS
+from ..signals import batch_sent
+from ..ratelimit import RateLimit, RateLimiter, get_domains, parse_rate
+
+
+class RateLimitTest(TestCase):
+
+    def setUp(self):
+        self.rate_limiter = RateLimiter(LocMemCache('ratelimit-test', {}))
+        self.rate_limiter.backend.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/s'), RateLimit(10, 1))
+        self.assertEqual(parse_rate('500/h'), RateLimit(500, 3600))
+        self.assertEqual(parse_rate('5/minute'), RateLimit(5, 60))
+        self.assertEqual(parse_rate((3, 10)), RateLimit(3, 10))
+        self.assertRaises(ImproperlyConfigured, parse_rate, '10')
+        self.assertRaises(ImproperlyConfigured, parse_rate, '10/y')
+
+    def test_get_domains(self):
+        email = Email(to=['Alice <alice@Example.com>', 'bob@example.com'],
+                      cc=['carol@example.org'])
+        self.assertEqual(get_domains(email), ['example.com', 'example.org'])
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE,
+                                        BACKEND_RATE_LIMITS={'default': '2/h'}))
+    def test_backend_limit(self):
+        email = Email(to=['to@example.com'])
+        self.assertIsNone(self.rate_limiter.acquire(email))
+        self.assertIsNone(self.rate_limiter.acquire(email))
+        delay = self.rate_limiter.acquire(email)
+        self.assertTrue(0 < delay <= 3600)
+
+        # Other backends are not limited
+        self.assertIsNone(self.rate_limiter.acquire(Email(to=['to@example.com'],
+                                                          backend_alias='locmem')))
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE,
+                                        BACKEND_RATE_LIMITS={'default': '2/h'},
+                                        DOMAIN_RATE_LIMITS={'example.com': '1/h'}))
+    def test_domain_limit(self):
+        self.assertIsNone(self.rate_limiter.acquire(Email(to=['to@example.com'])))
+        self.assertIsNotNone(self.rate_limiter.acquire(Email(to=['to@example.com'])))
+        # The backend token taken by the deferred email was given back
+        self.assertIsNone(self.rate_limiter.acquire(Email(to=['to@example.org'])))
+        self.assertIsNotNone(self.rate_limiter.acquire(Email(to=['to@example.org'])))
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE,
+                                        BACKEND_RATE_LIMITS={'locmem': '2/h'}))
+    def test_send_queued_defers_emails(self):
+        """
+        Emails exceeding a limit are queued again instead of failing
+        """
+        batches = []
+
+        def receiver(sender, emails, **kwargs):
+            batches.append(emails)
+        batch_sent.connect(receiver)
+        self.addCleanup(batch_sent.disconnect, receiver)
+
+        RateLimiter().backend.clear()
+        for i in range(3):
+            Email.objects.create(to=['to@example.com'], from_email='bob@example.com',
+                                 status=STATUS.queued, backend_alias='locmem')
+        self.assertEqual(send_queued(), (2, 0))
+
+        deferred = Email.objects.get(status=STATUS.queued)
+        self.assertEqual(len(batches[0]), 2)
+        self.assertNotIn(deferred, batches[0])
+        self.assertEqual(deferred.claimed_by, '')
+        self.assertGreater(deferred.scheduled_time, now())
+        self.assertEqual(deferred.logs.count(), 0)
+        self.assertEqual(send_queued(), (0, 0))
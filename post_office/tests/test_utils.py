@@ -1,11 +1,18 @@
+import smtplib
+import socket
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
 
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils.timezone import now
 
 from ..models import Email, STATUS, PRIORITY, EmailTemplate, Attachment
-from ..utils import (create_attachments, get_email_template, parse_emails,
+from ..utils import (chunked, create_attachments, get_email_template,
+                     get_retry_delay, is_transient_error, parse_emails,
                      parse_priority, send_mail, split_emails)
 from ..validators import validate_email_with_name, validate_comma_separated_emails
 
@@ -132,6 +139,29 @@ class UtilsTest(TestCase):
         email_list = split_emails(Email.objects.all(), 4)
         self.assertEqual(expected_size, [len(emails) for emails in email_list])
 
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked(iter(range(4)), 2)), [[0, 1], [2, 3]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_is_transient_error(self):
+        self.assertTrue(is_transient_error(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient_error(socket.timeout()))
+        self.assertTrue(is_transient_error(smtplib.SMTPDataError(421, 'Try again later')))
+        self.assertFalse(is_transient_error(smtplib.SMTPDataError(554, 'Rejected')))
+        self.assertTrue(is_transient_error(smtplib.SMTPRecipientsRefused(
+            {'to@example.com': (450, 'Mailbox busy')})))
+        self.assertFalse(is_transient_error(smtplib.SMTPRecipientsRefused(
+            {'to@example.com': (450, 'Mailbox busy'), 'no@example.com': (550, 'Unknown')})))
+        self.assertFalse(is_transient_error(ValueError('Invalid')))
+
+    @override_settings(POST_OFFICE=dict(settings.POST_OFFICE, RETRY_INTERVAL=10,
+                                        MAX_RETRY_INTERVAL=60))
+    def test_get_retry_delay(self):
+        self.assertTrue(5 <= get_retry_delay(0) <= 10)
+        self.assertTrue(10 <= get_retry_delay(1) <= 20)
+        self.assertTrue(30 <= get_retry_delay(5) <= 60)
+
     def test_create_attachments(self):
         attachments = create_attachments({
             'attachment_file1.txt': ContentFile('content'),
@@ -176,6 +206,30 @@ class UtilsTest(TestCase):
         self.assertEquals(attachments[0].name, 'attachment_file.py')
         self.assertEquals(attachments[0].mimetype, u'')
 
+    def test_create_attachments_deduplicates_content(self):
+        """
+        Attachments with the same content share a file, and identical
+        attachments share a row.
+        """
+        attachment = create_attachments({'report.txt': ContentFile('content')})[0]
+        self.assertEqual(len(attachment.hash), 64)
+
+        # Reusing an attachment protects it from cleanup again
+        last_used = now() - timedelta(days=1)
+        Attachment.objects.update(last_used=last_used)
+        self.assertEqual(create_attachments({'report.txt': ContentFile('content')}),
+                         [attachment])
+        self.assertGreater(Attachment.objects.get(id=attachment.id).last_used, last_used)
+
+        renamed = create_attachments({'renamed.txt': ContentFile('content')})[0]
+        self.assertNotEqual(renamed, attachment)
+        self.assertEqual(renamed.name, 'renamed.txt')
+        self.assertEqual(renamed.file.name, attachment.file.name)
+
+        other = create_attachments({'report.txt': ContentFile('other content')})[0]
+        self.assertNotEqual(other.file.name, attachment.file.name)
+        self.assertEqual(Attachment.objects.count(), 3)
+
     def test_parse_priority(self):
         self.assertEqual(parse_priority('now'), PRIORITY.now)
         self.assertEqual(parse_priority('high'), PRIORITY.high)
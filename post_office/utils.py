@@ -1,20 +1,31 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
+import hashlib
 import logging
+import random
+import smtplib
+import socket
 import tempfile
+from datetime import timedelta
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files import File
+from django.db import connection, transaction
 from django.template.loader import render_to_string
 from django.utils import translation
 from django.utils.encoding import force_text
+from django.utils.timezone import now
 from django.utils.translation import (ugettext, ugettext_lazy as _, 
                                       get_language)
 
-from post_office import cache
-from .compat import string_types
-from .models import Email, PRIORITY, STATUS, EmailTemplate, Attachment
-from .settings import get_default_priority
+from post_office import bodies, cache
+from .compat import string_types, text_type
+from .models import (ArchivedEmail, ArchivedLog, Attachment, AttachmentTemplate,
+                     Email, EmailBody, EmailTemplate, Log, PRIORITY, STATUS)
+from .notify import notify
+from .settings import (get_default_priority, get_max_retry_interval,
+                       get_retry_interval)
 from .validators import validate_email_with_name
 
 logger = logging.getLogger('post_office')
@@ -40,6 +51,8 @@ def send_mail(subject, message, from_email, recipient_list, html_message='',
     if priority == PRIORITY.now:
         for email in emails:
             email.dispatch()
+    elif emails:
+        notify()
     return emails
 
 
@@ -72,6 +85,164 @@ def split_emails(emails, split_count=1):
         return [emails[i::split_count] for i in range(split_count)]
 
 
+def chunked(iterable, size):
+    """
+    Yields lists of at most ``size`` items from ``iterable``.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def raw_delete(model, field_name, values):
+    """
+    Deletes the rows of ``model`` whose ``field_name`` is in ``values`` with
+    a single query. Unlike ``QuerySet.delete()``, rows are not loaded and
+    cascades or signals are not run. ``values`` should be kept under the
+    database's parameter limit, e.g. with ``chunked()``.
+    """
+    if not values:
+        return 0
+    quote_name = connection.ops.quote_name
+    sql = 'DELETE FROM %s WHERE %s IN (%s)' % (
+        quote_name(model._meta.db_table),
+        quote_name(model._meta.get_field(field_name).column),
+        ', '.join(['%s'] * len(values)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(values))
+        return cursor.rowcount
+
+
+def delete_emails(email_ids):
+    """
+    Deletes emails along with their logs and attachment links, with one
+    query per table.
+    """
+    raw_delete(Log, 'email', email_ids)
+    raw_delete(Attachment.emails.through, 'email', email_ids)
+    return raw_delete(Email, 'id', email_ids)
+
+
+def delete_archived_emails(email_ids):
+    """
+    Deletes archived emails along with their logs and attachment links,
+    with one query per table.
+    """
+    raw_delete(ArchivedLog, 'email', email_ids)
+    raw_delete(ArchivedEmail.attachments.through, 'archivedemail', email_ids)
+    return raw_delete(ArchivedEmail, 'id', email_ids)
+
+
+def delete_orphaned_bodies(batch_size=500):
+    """
+    Deletes the stored bodies that no email or archived email uses anymore
+    and that weren't stored or reused in the last ``bodies.MIN_AGE`` minutes.
+    Returns the number of bodies deleted.
+    """
+    cutoff_date = now() - timedelta(minutes=bodies.MIN_AGE)
+    queryset = EmailBody.objects.filter(last_used__lt=cutoff_date) \
+        .order_by('id').values_list('id', flat=True)
+    count = 0
+    last_id = 0
+    while True:
+        body_ids = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not body_ids:
+            return count
+        last_id = body_ids[-1]
+        with transaction.atomic():
+            # Locked so that they can't be reused while being deleted, a
+            # concurrent reuse updating last_used first
+            body_ids = list(queryset.select_for_update().filter(id__in=body_ids))
+            used_ids = set()
+            for model in (Email, ArchivedEmail):
+                for field_name in ('message_body', 'html_message_body'):
+                    used_ids.update(model.objects.filter(**{field_name + '__in': body_ids})
+                                    .values_list(field_name, flat=True))
+            count += raw_delete(EmailBody, 'id',
+                                [pk for pk in body_ids if pk not in used_ids])
+
+
+def get_unused_files(names):
+    """
+    Returns the set of storage names in ``names`` that are not the file of
+    any attachment or attachment template.
+    """
+    names = set(name for name in names if name)
+    if names:
+        names.difference_update(
+            Attachment.objects.filter(file__in=names).values_list('file', flat=True))
+    if names:
+        names.difference_update(
+            AttachmentTemplate.objects.filter(file__in=names).values_list('file', flat=True))
+    return names
+
+
+def delete_orphaned_attachments(queryset, batch_size=500, pool=None, min_age=60):
+    """
+    Deletes the attachments in ``queryset`` that are not linked to any email
+    or archived email and weren't created or reused by
+    ``create_attachments()`` in the last ``min_age`` minutes, as they may be
+    about to be linked to a new email. Their files are deleted from storage
+    unless another attachment, e.g. a deduplicated copy, still uses them.
+    Files are deleted from the threads of ``pool`` if given. Returns the
+    number of attachments deleted.
+    """
+    cutoff_date = now() - timedelta(minutes=min_age)
+    orphans = queryset.filter(emails=None, archived_emails=None,
+                              last_used__lt=cutoff_date) \
+        .order_by('id').values_list('id', 'file')
+    storage = Attachment._meta.get_field('file').storage
+    count = 0
+    last_id = 0
+    while True:
+        rows = list(orphans.filter(id__gt=last_id)[:batch_size])
+        if not rows:
+            return count
+        last_id = rows[-1][0]
+
+        with transaction.atomic():
+            # Locked and checked again, as create_attachments() may have
+            # reused some of them since they were listed. The links are
+            # checked separately as outer joins can't be locked.
+            rows = list(Attachment.objects.select_for_update()
+                        .filter(id__in=[pk for pk, name in rows],
+                                last_used__lt=cutoff_date)
+                        .values_list('id', 'file'))
+            linked_ids = set()
+            for through in (Attachment.emails.through,
+                            ArchivedEmail.attachments.through):
+                linked_ids.update(through.objects
+                                  .filter(attachment_id__in=[pk for pk, name in rows])
+                                  .values_list('attachment_id', flat=True))
+            rows = [(pk, name) for pk, name in rows if pk not in linked_ids]
+            count += raw_delete(Attachment, 'id', [pk for pk, name in rows])
+
+        names = get_unused_files(name for pk, name in rows)
+        if pool is not None:
+            pool.map(storage.delete, names)
+        else:
+            for name in names:
+                storage.delete(name)
+
+
+def get_file_hash(content):
+    """
+    Returns the SHA-256 hex digest of a Django ``File`` and rewinds it.
+    """
+    hasher = hashlib.sha256()
+    for chunk in content.chunks():
+        if isinstance(chunk, text_type):
+            chunk = chunk.encode('utf-8')
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
 def create_attachments(attachment_files):
     """
     Create Attachment instances from files
@@ -80,6 +251,10 @@ def create_attachments(attachment_files):
         * Key - the filename to be used for the attachment.
         * Value - file-like object, or a filename to open OR a dict of {'file': file-like-object, 'mimetype': string}
 
+    Attachments are deduplicated by content: an existing Attachment with the
+    same content, filename and mimetype is reused, and an existing file with
+    the same content is referenced instead of being stored again.
+
     Returns a list of Attachment objects
     """
     attachments = []
@@ -98,11 +273,31 @@ def create_attachments(attachment_files):
             # `content` is a filename - try to open the file
             opened_file = open(content, 'rb')
             content = File(opened_file)
-
-        attachment = Attachment()
-        if mimetype:
-            attachment.mimetype = mimetype
-        attachment.file.save(filename, content=content, save=True)
+        elif not isinstance(content, File):
+            content = File(content)
+
+        content_hash = get_file_hash(content)
+        attachment = Attachment.objects.filter(
+            hash=content_hash, name=filename, mimetype=mimetype or '').first()
+        # Keeps cleanup from deleting it before it is linked, unless it was
+        # deleted in the meantime
+        if attachment is not None and \
+                not Attachment.objects.filter(id=attachment.id).update(last_used=now()):
+            attachment = None
+
+        if attachment is None:
+            attachment = Attachment(hash=content_hash, name=filename)
+            if mimetype:
+                attachment.mimetype = mimetype
+
+            duplicate = Attachment.objects.filter(hash=content_hash) \
+                .exclude(file='').first()
+            if duplicate is not None:
+                Attachment.objects.filter(id=duplicate.id).update(last_used=now())
+                attachment.file = duplicate.file.name
+                attachment.save()
+            else:
+                attachment.file.save(filename, content=content, save=True)
 
         attachments.append(attachment)
 
@@ -151,3 +346,36 @@ def parse_emails(emails):
 
 
 
+
+
+def is_transient_error(exception):
+    """
+    Returns True if a delivery failure is likely temporary and worth
+    retrying: connection errors and 4xx SMTP replies. 5xx replies and
+    other errors are permanent.
+    """
+    if isinstance(exception, (smtplib.SMTPServerDisconnected,
+                              smtplib.SMTPConnectError)):
+        return True
+    if isinstance(exception, smtplib.SMTPRecipientsRefused):
+        return bool(exception.recipients) and all(
+            400 <= code < 500 for code, message in exception.recipients.values())
+    # smtplib and aiosmtplib store the reply code under different names
+    code = getattr(exception, 'smtp_code', getattr(exception, 'code', None))
+    if isinstance(code, int):
+        return 400 <= code < 500
+    # On Python 3, smtplib exceptions are also socket errors
+    return isinstance(exception, socket.error) and \
+        not isinstance(exception, smtplib.SMTPException)
+
+
+def get_retry_delay(number_of_retries):
+    """
+    Returns the number of seconds to wait before retrying an email that
+    already failed ``number_of_retries`` times. The delay doubles after
+    each attempt up to ``MAX_RETRY_INTERVAL``, and is randomized so that
+    emails that failed together aren't retried together.
+    """
+    delay = min(get_retry_interval() * 2 ** number_of_retries,
+                get_max_retry_interval())
+    return delay / 2.0 + random.uniform(0, delay / 2.0)